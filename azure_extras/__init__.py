@@ -1,8 +1,33 @@
 # Copyright (c) 2018, Toby Slight. All rights reserved.
 # ISC License (ISCL) - see LICENSE file for details.
 
+from importlib import import_module
+
 name = "azure_extras"
-from .lib.az import AzureExtras
-from .lib.app import AppService
-from .lib.kudu import KuduClient
-from .lib.saj import StreamAnalyticsJobs
+
+# Clients are only imported when first used, so the CLIs don't pay for
+# clients (and SDKs such as aiohttp) they never touch.
+EXPORTS = {
+    "AzureExtras": ".lib.az",
+    "AppService": ".lib.app",
+    "KuduClient": ".lib.kudu",
+    "KuduRegistry": ".lib.registry",
+    "StreamAnalyticsJobs": ".lib.saj",
+    "AsyncAppService": ".lib.aio",
+    "AsyncKuduClient": ".lib.aio",
+    "AsyncStreamAnalyticsJobs": ".lib.aio",
+}
+
+__all__ = list(EXPORTS)
+
+
+def __getattr__(attr):
+    if attr in EXPORTS:
+        value = getattr(import_module(EXPORTS[attr], __name__), attr)
+        globals()[attr] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {attr!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
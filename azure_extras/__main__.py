@@ -0,0 +1,63 @@
+import sys
+from importlib import import_module
+from .lib.rpc import COMMANDS, forward
+
+
+def usage():
+    return "usage: azure-extras {daemon," + ",".join(COMMANDS) + "} [args...]"
+
+
+def run(command, argv, prog):
+    """
+    Run command through the daemon if it's running, and in-process if not.
+    """
+    code = forward(command, argv)
+    if code is not None:
+        sys.exit(code)
+
+    sys.argv = [prog, *argv]
+    import_module(COMMANDS[command]).main()
+
+
+def main():
+    """
+    Run one of the CLIs as a subcommand, e.g. azure-extras asctl -a app -A stop
+    """
+    if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help"):
+        print(usage())
+        sys.exit(0 if len(sys.argv) > 1 else 2)
+    command, argv = sys.argv[1], sys.argv[2:]
+    if command == "daemon":
+        sys.argv = ["azure-extras daemon", *argv]
+        return import_module("azure_extras.daemonctl").main()
+    if command not in COMMANDS:
+        sys.exit(f"{usage()}\nazure-extras: unknown command {command}")
+    run(command, argv, f"azure-extras {command}")
+
+
+# The az-* scripts, which only import the module behind them when there's no
+# daemon to hand the command to.
+
+
+def asctl():
+    run("asctl", sys.argv[1:], "az-asctl")
+
+
+def healthchkctl():
+    run("healthchkctl", sys.argv[1:], "az-healthchkctl")
+
+
+def kuductl():
+    run("kuductl", sys.argv[1:], "az-kuductl")
+
+
+def planctl():
+    run("planctl", sys.argv[1:], "az-planctl")
+
+
+def sajctl():
+    run("sajctl", sys.argv[1:], "az-sajctl")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 import logging
 import os
 from argparse import ArgumentParser
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from .lib.app import AppService
-from .lib.utils import chkpath, mklog
+from .lib.reconcile import print_report, reconcile_app_services
+from .lib.scheduler import Scheduler
+from .lib.trace import enable_tracing
+from .lib.utils import add_selector_args, add_trace_args, chkpath, mklog, select
 
 
 def get_args():
@@ -34,59 +36,210 @@ def get_args():
         default=f"{os.path.expanduser('~')}/.azure.ini",
         help="path to azure configuration file",
     )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        action="store_true",
+        help="send toggles and status checks as ARM batch requests",
+    )
+    parser.add_argument(
+        "--aio",
+        action="store_true",
+        help="drive every app and slot from a single asyncio event loop",
+    )
+    parser.add_argument(
+        "-n",
+        "--concurrency",
+        type=int,
+        default=20,
+        metavar=("N"),
+        help="maximum concurrent requests",
+    )
+    parser.add_argument(
+        "-o",
+        "--order",
+        choices=("apps-first", "slots-first"),
+        help="toggle production apps before their slots, or the other way round",
+    )
+    parser.add_argument(
+        "--reconcile",
+        action="store_true",
+        help="read current state in bulk and only send writes to apps and slots that differ",
+    )
+    add_selector_args(parser)
+    add_trace_args(parser)
     parser.add_argument("-v", action="count", default=0, help="increase verbosity")
     return parser.parse_args()
 
 
-def asctl(config, rg, apps, action):
-    app_service = AppService(config, rg)
+def asctl(config, rg, apps, action, concurrency=20, order=None):
+    """
+    Toggle apps and their slots on one bounded pool. Slot listings start
+    straight away and each slot toggle is scheduled as soon as its app's
+    listing comes back. order makes slots wait for their production app
+    ("apps-first") or the other way round ("slots-first").
+    """
+    app_service = AppService(config, rg, pool_size=concurrency)
+    scheduler = Scheduler(workers=concurrency)
 
-    # http://masnun.com/2016/03/29/python-a-quick-introduction-to-the-concurrent-futures-module.html
-    with ThreadPoolExecutor(max_workers=len(apps)) as executor:
-        future_app = {
-            executor.submit(app_service.toggle_app_service, app, action): app
-            for app in apps
-        }
-        for future in as_completed(future_app):
-            app = future_app[future]
-            print(f"Sending {action} to {app}.. ", end="", flush="True")
-            try:
-                result = future.result()
-            except ValueError as error:
-                print(f"FAILED.")
-                logging.error(error)
-            else:
-                print(result.upper() + ".")
+    def list_slots(app):
+        listing = app_service.list_app_service_slots(app)
+        if listing is None:
+            raise AssertionError(f"Failed to get slots for {app}")
+        return [slot["name"].split("/")[1] for slot in listing["value"]]
 
-    for app in apps:
-        slots = [
-            slot["name"].split("/")[1]
-            for slot in app_service.list_app_service_slots(app)["value"]
-        ]
+    def toggle_app(app):
+        status = app_service.toggle_app_service(app, action)
+        if status is None:
+            # Failures are logged and swallowed by the toggle, but whatever is
+            # ordered after it must not run.
+            raise AssertionError(f"Failed to {action} {app}")
+        return status
+
+    def toggle_slot(app, slot):
+        status = app_service.toggle_app_service_slot(app, slot, action)
+        if status is None:
+            raise AssertionError(f"Failed to {action} {slot}")
+        return status
+
+    def schedule_slots(app, slots):
         logging.info("Found " + ", ".join(slots) + " slots for " + app)
-        with ThreadPoolExecutor(max_workers=len(slots)) as executor:
-            future_slot = {
-                executor.submit(
-                    app_service.toggle_app_service_slot, app, slot, action
-                ): slot
-                for slot in slots
-            }
-            for future in as_completed(future_slot):
-                slot = future_slot[future]
-                print(f"Sending {action} to {slot}.. ", end="", flush="True")
+        after = [("app", app)] if order == "apps-first" else []
+        for slot in slots:
+            scheduler.add(("slot", app, slot), toggle_slot, app, slot, after=after)
+        # Marks every slot of the app as done, for "slots-first".
+        scheduler.add(
+            ("slots", app), lambda: None, after=[("slot", app, s) for s in slots]
+        )
+
+    for app in apps:
+        scheduler.add(
+            ("list", app),
+            list_slots,
+            app,
+            then=lambda slots, app=app: schedule_slots(app, slots),
+        )
+        # With "slots-first", a failed listing fails the app too, rather than
+        # leaving it waiting on slots that never get scheduled.
+        scheduler.add(
+            ("app", app),
+            toggle_app,
+            app,
+            after=[("list", app), ("slots", app)] if order == "slots-first" else [],
+        )
+
+    for key, result, error in scheduler.run():
+        if error:
+            logging.error(error)
+        if key[0] in ("app", "slot"):
+            status = result.upper() if result else "FAILED"
+            print(f"Sending {action} to {key[-1]}.. {status}.")
+
+
+def asctl_aio(config, rg, apps, action, concurrency):
+    # asyncio and aiohttp are only needed with --aio.
+    import asyncio
+    from .lib.aio import AsyncAppService
+
+    async def run():
+        async with AsyncAppService(config, rg, concurrency) as app_service:
+
+            async def toggle(name, coro):
                 try:
-                    result = future.result()
+                    result = await coro
                 except ValueError as error:
-                    print(f"FAILED.")
+                    result = None
                     logging.error(error)
-                else:
-                    print(result.upper() + ".")
+                status = result.upper() if result else "FAILED"
+                print(f"Sending {action} to {name}.. {status}.")
+
+            await asyncio.gather(
+                *(
+                    toggle(app, app_service.toggle_app_service(app, action))
+                    for app in apps
+                )
+            )
+
+            listings = await asyncio.gather(
+                *(app_service.list_app_service_slots(app) for app in apps)
+            )
+            toggles = []
+            for app, listing in zip(apps, listings):
+                slots = [slot["name"].split("/")[1] for slot in listing["value"]]
+                logging.info("Found " + ", ".join(slots) + " slots for " + app)
+                toggles += [
+                    toggle(slot, app_service.toggle_app_service_slot(app, slot, action))
+                    for slot in slots
+                ]
+            await asyncio.gather(*toggles)
+
+    asyncio.run(run())
+
+
+def asctl_batch(config, rg, apps, action):
+    app_service = AppService(config, rg)
+
+    for app, status in app_service.toggle_many(apps, action).items():
+        print(f"Sending {action} to {app}.. {status.upper() if status else 'FAILED'}.")
+
+    slots = []
+    for app, listing in app_service.list_app_service_slots_many(apps).items():
+        names = [slot["name"].split("/")[1] for slot in listing["value"]]
+        logging.info("Found " + ", ".join(names) + " slots for " + app)
+        slots += [f"{app}/slots/{name}" for name in names]
+
+    for slot, status in app_service.toggle_many(slots, action).items():
+        name = slot.split("/")[-1]
+        print(f"Sending {action} to {name}.. {status.upper() if status else 'FAILED'}.")
+
+
+def asctl_reconcile(config, rg, apps, action):
+    app_service = AppService(config, rg)
+
+    names = list(apps)
+    for app, listing in app_service.list_app_service_slots_many(apps).items():
+        slots = [slot["name"].split("/")[1] for slot in listing["value"]]
+        logging.info("Found " + ", ".join(slots) + " slots for " + app)
+        names += [f"{app}/slots/{slot}" for slot in slots]
+
+    print_report(reconcile_app_services(app_service, names, action), action)
 
 
 def main():
     args = get_args()
     mklog(args.v)
-    asctl(args.config, args.resource_group, args.app_services, args.action)
+    enable_tracing(args.trace, args.otel, args.summary)
+    args.app_services = select(
+        args.app_services,
+        args,
+        lambda *selectors: AppService(
+            args.config, args.resource_group
+        ).select_app_services(*selectors),
+        "apps",
+    )
+    if args.aio:
+        asctl_aio(
+            args.config,
+            args.resource_group,
+            args.app_services,
+            args.action,
+            args.concurrency,
+        )
+    elif args.reconcile:
+        asctl_reconcile(
+            args.config, args.resource_group, args.app_services, args.action
+        )
+    elif args.batch:
+        asctl_batch(args.config, args.resource_group, args.app_services, args.action)
+    else:
+        asctl(
+            args.config,
+            args.resource_group,
+            args.app_services,
+            args.action,
+            args.concurrency,
+            args.order,
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,67 @@
+import json
+import os
+from argparse import ArgumentParser
+from .lib.daemon import Daemon
+from .lib.rpc import SOCKET_PATH, call, connect, receive, send
+from .lib.utils import mklog
+
+
+def get_args():
+    parser = ArgumentParser(
+        description="Keep clients, tokens and connections warm for the CLIs"
+    )
+    parser.add_argument(
+        "-s",
+        "--socket",
+        metavar=("PATH"),
+        default=SOCKET_PATH,
+        help="unix socket to listen on (also set AZURE_EXTRAS_SOCKET for the CLIs)",
+    )
+    parser.add_argument(
+        "-i",
+        "--idle_timeout",
+        type=int,
+        default=0,
+        metavar=("SECONDS"),
+        help="stop after this long without a command (0 never stops)",
+    )
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        "--status", action="store_true", help="show the running daemon's status"
+    )
+    group.add_argument("--stop", action="store_true", help="stop the running daemon")
+    parser.add_argument("-v", action="count", default=0, help="increase verbosity")
+    return parser.parse_args()
+
+
+def status(path):
+    sock = connect(path)
+    if sock is None:
+        raise SystemExit(f"No daemon listening on {path}")
+    with sock:
+        send(sock, {"command": "status"})
+        for message in receive(sock):
+            if "stdout" in message:
+                print(json.dumps(json.loads(message["stdout"]), indent=2))
+
+
+def stop(path):
+    if call("stop", path=path) is None:
+        raise SystemExit(f"No daemon listening on {path}")
+    print(f"Stopped daemon on {path}")
+
+
+def main():
+    args = get_args()
+    mklog(args.v)
+    if args.status:
+        status(args.socket)
+    elif args.stop:
+        stop(args.socket)
+    else:
+        print(f"Listening on {args.socket} (pid {os.getpid()})", flush=True)
+        Daemon(args.socket, args.idle_timeout).serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,9 @@ import os
 from argparse import ArgumentParser
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from .lib.app import AppService
-from .lib.utils import chkpath, mklog
+from .lib.reconcile import print_report, reconcile_health_checks
+from .lib.trace import enable_tracing
+from .lib.utils import add_selector_args, add_trace_args, chkpath, mklog, select
 
 
 def get_args():
@@ -34,12 +36,32 @@ def get_args():
         default=f"{os.path.expanduser('~')}/.azure.ini",
         help="path to azure configuration file",
     )
+    parser.add_argument(
+        "--aio",
+        action="store_true",
+        help="drive every app from a single asyncio event loop",
+    )
+    parser.add_argument(
+        "-n",
+        "--concurrency",
+        type=int,
+        default=20,
+        metavar=("N"),
+        help="maximum concurrent requests when using --aio",
+    )
+    parser.add_argument(
+        "--reconcile",
+        action="store_true",
+        help="read current state in bulk and only send writes to apps that differ",
+    )
+    add_selector_args(parser)
+    add_trace_args(parser)
     parser.add_argument("-v", action="count", default=0, help="increase verbosity")
     return parser.parse_args()
 
 
 def healthchkctl(config, rg, apps, action):
-    app_service = AppService(config, rg)
+    app_service = AppService(config, rg, pool_size=len(apps))
 
     # http://masnun.com/2016/03/29/python-a-quick-introduction-to-the-concurrent-futures-module.html
     with ThreadPoolExecutor(max_workers=len(apps)) as executor:
@@ -59,10 +81,59 @@ def healthchkctl(config, rg, apps, action):
                 print(f"DONE.")
 
 
+def healthchkctl_aio(config, rg, apps, action, concurrency):
+    # asyncio and aiohttp are only needed with --aio.
+    import asyncio
+    from .lib.aio import AsyncAppService
+
+    async def run():
+        async with AsyncAppService(config, rg, concurrency) as app_service:
+
+            async def toggle(app):
+                try:
+                    await app_service.toggle_health_check(app, action)
+                except (ValueError, AssertionError) as error:
+                    print(f"Sending {action} to {app}.. FAILED.")
+                    logging.error(error)
+                else:
+                    print(f"Sending {action} to {app}.. DONE.")
+
+            await asyncio.gather(*(toggle(app) for app in apps))
+
+    asyncio.run(run())
+
+
+def healthchkctl_reconcile(config, rg, apps, action):
+    app_service = AppService(config, rg, pool_size=len(apps))
+    print_report(reconcile_health_checks(app_service, apps, action), action)
+
+
 def main():
     args = get_args()
     mklog(args.v)
-    healthchkctl(args.config, args.resource_group, args.app_services, args.action)
+    enable_tracing(args.trace, args.otel, args.summary)
+    args.app_services = select(
+        args.app_services,
+        args,
+        lambda *selectors: AppService(
+            args.config, args.resource_group
+        ).select_app_services(*selectors),
+        "apps",
+    )
+    if args.aio:
+        healthchkctl_aio(
+            args.config,
+            args.resource_group,
+            args.app_services,
+            args.action,
+            args.concurrency,
+        )
+    elif args.reconcile:
+        healthchkctl_reconcile(
+            args.config, args.resource_group, args.app_services, args.action
+        )
+    else:
+        healthchkctl(args.config, args.resource_group, args.app_services, args.action)
 
 
 if __name__ == "__main__":
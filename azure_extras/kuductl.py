@@ -2,13 +2,24 @@ import json
 import logging
 import os
 from argparse import ArgumentParser
-from .lib.kudu import KuduClient
-from .lib.utils import chkpath, mklog
+from .lib.fanout import fan_out
+from .lib.logmerge import tail_fleet
+from .lib.registry import KuduRegistry
+from .lib.transfer import CHUNK_SIZE
+from .lib.trace import enable_tracing
+from .lib.utils import add_trace_args, chkpath, mklog
 
 
-def get_args():
+def get_parser():
     parser = ArgumentParser(description="CLI Kudu API Frontend")
-    parser.add_argument("-a", "--app", metavar=("NAME"), help="azure app service name")
+    parser.add_argument(
+        "-a",
+        "--app",
+        nargs="+",
+        required=True,
+        metavar=("NAME"),
+        help="azure app service name(s), logs from several apps are merged",
+    )
     parser.add_argument(
         "-C",
         "--config",
@@ -29,6 +40,14 @@ def get_args():
     group.add_argument(
         "-l", "--logs", const=50, type=int, nargs="?", help="get logs lines"
     )
+    group.add_argument(
+        "-f",
+        "--follow",
+        const="",
+        nargs="?",
+        metavar=("PATH"),
+        help="stream new log lines as they are written",
+    )
     group.add_argument(
         "-z",
         "--deploy_zip",
@@ -36,6 +55,13 @@ def get_args():
         type=chkpath,
         help="upload a zip to the server",
     )
+    group.add_argument(
+        "-s",
+        "--sync",
+        metavar=("PATH"),
+        type=chkpath,
+        help="upload only the files in a local directory that changed",
+    )
     group.add_argument(
         "-Z",
         "--download_zip",
@@ -51,8 +77,50 @@ def get_args():
         metavar=("PATH"),
         help="server current working directory",
     )
+    parser.add_argument(
+        "-i",
+        "--all_instances",
+        action="store_true",
+        help="run --cmd on every instance, printing results as json lines",
+    )
+    parser.add_argument(
+        "-t",
+        "--timeout",
+        type=int,
+        default=60,
+        metavar=("SECONDS"),
+        help="per instance timeout for commands run on many targets",
+    )
+    parser.add_argument(
+        "--delete",
+        action="store_true",
+        help="delete remote files missing from the directory given to --sync",
+    )
+    parser.add_argument(
+        "-g",
+        "--grep",
+        metavar=("REGEX"),
+        help="only show followed log lines matching this pattern",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=CHUNK_SIZE,
+        metavar=("BYTES"),
+        help="size of the chunks zips are streamed in",
+    )
+    parser.add_argument(
+        "--checksum",
+        metavar=("ALGORITHM"),
+        help="hash the zip with this algorithm (e.g. sha256) while uploading it",
+    )
+    add_trace_args(parser)
     parser.add_argument("-v", action="count", default=0, help="increase verbosity")
-    return parser.parse_args()
+    return parser
+
+
+def get_args():
+    return get_parser().parse_args()
 
 
 def run_cmd(kudu, cmd, cwd):
@@ -87,10 +155,10 @@ def get_endpoint(kudu, endpoint):
         logging.error(error)
 
 
-def deploy_zip(kudu, path):
+def deploy_zip(kudu, path, checksum=None, chunk_size=CHUNK_SIZE):
     print(f"Deploying {path} to {kudu.app}.. ", end="", flush="True")
     try:
-        response = kudu.deploy_zip(path)
+        response = kudu.deploy_zip(path, chunk_size, checksum)
         print(f"DONE.") if response["complete"] else print(f"FAILED.")
         logging.info("\n" + json.dumps(response, indent=2, sort_keys=True))
     except Exception as error:
@@ -98,7 +166,25 @@ def deploy_zip(kudu, path):
         logging.error(error)
 
 
-def download_zip(kudu, paths):
+def sync_directory(kudu, local, remote, delete):
+    print(f"Syncing {local} to {kudu.app}/{remote}.. ", end="", flush="True")
+    try:
+        result = kudu.sync_directory(local, remote, delete)
+        print(
+            f"DONE. {len(result['uploaded'])} uploaded, "
+            + f"{len(result['deleted'])} deleted, "
+            + f"{len(result['unchanged'])} unchanged."
+        )
+        for path in result["uploaded"]:
+            logging.info(f"Uploaded {path}")
+        for path in result["deleted"]:
+            logging.info(f"Deleted {path}")
+    except Exception as error:
+        print(f"FAILED.")
+        logging.error(error)
+
+
+def download_zip(kudu, paths, chunk_size=CHUNK_SIZE):
     source, destination = paths
     print(
         f"Downloading zip from {kudu.app}/{source} to {destination}.. ",
@@ -106,28 +192,71 @@ def download_zip(kudu, paths):
         flush="True",
     )
     try:
-        response = kudu.download_zip(source, destination)
+        response = kudu.download_zip(source, destination, chunk_size)
         print("DONE.") if response.ok else print("FAILED.")
     except Exception as error:
         print(f"FAILED.")
         logging.error(error)
 
 
+def follow_logs(kudu, path, pattern):
+    try:
+        for line in kudu.follow_logs(path, pattern):
+            print(line, flush=True)
+    except KeyboardInterrupt:
+        pass
+
+
+def fleet_cmd(registry, apps, cmd, cwd, timeout):
+    for record in fan_out(registry, apps, cmd, cwd, timeout=timeout):
+        print(json.dumps(record), flush=True)
+
+
+def fleet_logs(registry, apps, line_count):
+    errors = {}
+    clients = registry.get_many(apps, errors)
+    for app, error in errors.items():
+        logging.error(f"Failed to get logs for {app}: {error}")
+    width = max(len(app) for app in apps)
+    for timestamp, app, line in tail_fleet(clients, line_count):
+        print(f"{app:<{width}} | {line}", flush=True)
+
+
 def main():
     args = get_args()
     mklog(args.v)
-    kudu = KuduClient(args.config, args.rg, args.app)
+    enable_tracing(args.trace, args.otel, args.summary)
+    # The crawl, sync and fan out thread pools share these connections, so
+    # size them for the widest of those (16) however few apps are named.
+    pool_size = max(len(args.app), 16)
+    registry = KuduRegistry(args.config, args.rg, pool_size=pool_size)
+
+    if args.cmd and (len(args.app) > 1 or args.all_instances):
+        fleet_cmd(registry, args.app, args.cmd, args.cwd, args.timeout)
+        return
+
+    if len(args.app) > 1:
+        if not args.logs:
+            raise SystemExit("Only -l/--logs and -c/--cmd support several apps.")
+        fleet_logs(registry, args.app, args.logs)
+        return
+
+    kudu = registry.get(args.app[0])
 
     if args.cmd:
         run_cmd(kudu, args.cmd, args.cwd)
     elif args.logs:
         kudu.get_logs(args.logs)
+    elif args.follow is not None:
+        follow_logs(kudu, args.follow, args.grep)
     elif args.endpoint:
         get_endpoint(kudu, args.endpoint)
     elif args.deploy_zip:
-        deploy_zip(kudu, args.deploy_zip)
+        deploy_zip(kudu, args.deploy_zip, args.checksum, args.chunk_size)
+    elif args.sync:
+        sync_directory(kudu, args.sync, args.cwd, args.delete)
     elif args.download_zip:
-        download_zip(kudu, args.download_zip)
+        download_zip(kudu, args.download_zip, args.chunk_size)
 
 
 if __name__ == "__main__":
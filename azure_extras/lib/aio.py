@@ -0,0 +1,401 @@
+import asyncio
+import json
+import logging
+import os
+import traceback
+from urllib.parse import urlparse
+from .app import HEALTH_CHECK_PATHS, AppService
+from .kudu import KuduClient
+from .poll import Poller
+from .saj import StreamAnalyticsJobs
+from .session import ARM_HOST, RetryPolicy
+from .trace import body_size, get_tracer
+
+try:
+    import aiohttp
+except ImportError:
+    raise ImportError("Install aiohttp to use --aio.")
+
+
+def decode_body(text):
+    """
+    Decode a json response body, keeping anything else, such as an HTML
+    error page from a gateway, as {"message": text} instead of failing.
+    """
+    if not text:
+        return {}
+    try:
+        return json.loads(text)
+    except ValueError:
+        return {"message": text}
+
+
+class AsyncAzureExtras:
+    """
+    asyncio counterpart of AzureExtras.
+
+    Authentication and url building are done once by the wrapped sync client,
+    after which every request goes through a single aiohttp session. The
+    semaphore bounds how many requests are in flight at once, so hundreds of
+    resources can be driven from one thread with a handful of sockets. ARM
+    requests share the sync clients' rate limiter, retry budget and state
+    cache, and long running operations are followed with the same Poller.
+    """
+
+    def __init__(self, client, concurrency=20, max_retries=4):
+        self.client = client
+        self.url = client.url
+        self.cache = client.cache
+        self.concurrency = concurrency
+        self.retries = RetryPolicy(max_retries)
+        self.semaphore = None
+        self.session = None
+
+    @property
+    def headers(self):
+        return self.client.headers
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency, limit_per_host=self.concurrency
+        )
+        self.session = aiohttp.ClientSession(connector=connector)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def request(self, method, url, headers=None, **kwargs):
+        """
+        Send a request and return a (status, reason, body) tuple, where body is
+        the decoded json response or an empty dict.
+        """
+        response, body = await self.fetch(method, url, headers, **kwargs)
+        return response.status, response.reason, body
+
+    async def fetch(self, method, url, headers=None, **kwargs):
+        """
+        Send a request and return the (already read) response and its decoded
+        body.
+        """
+        headers = self.headers if headers is None else headers
+        span = get_tracer().start(method, url)
+        try:
+            response, text = await self.send_with_retries(
+                span, method, url, headers, **kwargs
+            )
+        except Exception as error:
+            if span:
+                span.finish(error=error)
+            raise
+
+        if span:
+            sent = kwargs.get("data")
+            if "json" in kwargs:
+                sent = json.dumps(kwargs["json"])
+            span.finish(
+                response.status, response.headers, body_size(sent), len(text.encode())
+            )
+        return response, decode_body(text)
+
+    async def send_with_retries(self, span, method, url, headers, **kwargs):
+        """
+        Return the final response and its text, retrying like AzureSession.
+        """
+        arm = urlparse(url).hostname == ARM_HOST
+        attempt = 0
+        while True:
+            if span:
+                span.retries = attempt
+            if arm:
+                await self.retries.limiter.acquire_async(method)
+            try:
+                async with self.semaphore:
+                    async with self.session.request(
+                        method, url, headers=headers, **kwargs
+                    ) as response:
+                        text = await response.text()
+            except aiohttp.ClientConnectionError as error:
+                sent = not isinstance(error, aiohttp.ClientConnectorError)
+                delay = self.retries.on_error(method, attempt, error, sent)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+
+            delay = self.retries.on_response(span, method, url, attempt, response)
+            if delay is None:
+                return response, text
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def wait_for_state(self, get_state, name, action, poller):
+        async def check():
+            status = await get_state()
+            started = status == "Running" and action == "start"
+            stopped = status == "Stopped" and action == "stop"
+            return started or stopped, status, None
+
+        done, status = await poller.wait_async(check)
+        if done:
+            return status
+
+        raise AssertionError(f"Failed to {action} {name}: {status}")
+
+    async def send_action(self, url, params, poller):
+        """
+        POST to an ARM action url and follow its long running operation, if
+        any, with poller. Raises AssertionError if either fails.
+        """
+        response, body = await self.fetch("POST", url, params=params)
+        if response.status >= 400:
+            raise AssertionError(f"{url} returned {response.status}")
+        await poller.wait_for_operation_async(self.fetch, response, self.headers)
+
+
+class AsyncAppService(AsyncAzureExtras):
+    def __init__(self, path, rg, concurrency=20):
+        super().__init__(AppService(path, rg, concurrency), concurrency)
+
+    async def get_app_service(self, app, max_age=0):
+        """
+        Get App Service
+
+        Served from the shared state cache when it is younger than max_age
+        seconds (never by default), and revalidated with its ETag otherwise.
+        """
+        url = f"{self.url}/{app}"
+        params = {"api-version": "2019-08-01"}
+        status, reason, body = await self.cache.get_async(
+            self.fetch, url, self.headers, params, max_age
+        )
+        if status >= 400:
+            raise AssertionError(f"Failed to get {app}: {status}")
+        return body["properties"]
+
+    async def list_app_service_slots(self, app):
+        """
+        List App Service Slots
+        """
+        url = f"{self.url}/{app}/slots"
+        params = {"api-version": "2019-08-01"}
+        status, reason, body = await self.request("GET", url, params=params)
+        if status >= 400:
+            raise AssertionError(f"Failed to get slots for {app}: {status}")
+        return body
+
+    async def get_app_service_slot(self, app, slot, max_age=0):
+        """
+        Get App Service Slot
+
+        Served from the shared state cache when it is younger than max_age
+        seconds (never by default), and revalidated with its ETag otherwise.
+        """
+        url = f"{self.url}/{app}/slots/{slot}"
+        params = {"api-version": "2019-08-01"}
+        status, reason, body = await self.cache.get_async(
+            self.fetch, url, self.headers, params, max_age
+        )
+        if status >= 400:
+            raise AssertionError(f"Failed to get {slot}: {status}")
+        return body["properties"]
+
+    async def toggle_health_check(self, app, action):
+        url = f"{self.url}/{app}/config/web"
+        params = {"api-version": "2018-02-01"}
+
+        if action not in HEALTH_CHECK_PATHS:
+            raise ValueError(f"{action} is invalid!")
+        patch = {"properties": {"healthCheckPath": HEALTH_CHECK_PATHS[action]}}
+
+        status, reason, content = await self.request(
+            "PATCH", url, params=params, data=json.dumps(patch)
+        )
+        if status >= 400:
+            raise AssertionError(f"Failed to patch {url} with {patch}, Code:{status}")
+        logging.debug(json.dumps(content, indent=2, sort_keys=True))
+        path = content["properties"]["healthCheckPath"]
+        if path != patch["properties"]["healthCheckPath"]:
+            raise AssertionError(f"Failed to patch {url} with {patch}.")
+
+    async def toggle_app_service(self, app, action):
+        """
+        START/STOP an Azure App Service
+        """
+        logging.debug(f"{action.capitalize()} {app}")
+        url = f"{self.url}/{app}/{action}"
+        params = {"api-version": "2016-08-01"}
+
+        try:
+            poller = Poller(deadline=30)
+            await self.send_action(url, params, poller)
+            logging.info(f"Sent {action.capitalize()} to {app}")
+            self.cache.invalidate(f"{self.url}/{app}")
+
+            async def get_state():
+                return (await self.get_app_service(app, max_age=0))["state"]
+
+            return await self.wait_for_state(get_state, app, action, poller)
+        except Exception as error:
+            logging.error(f"Failed to {action} {app}: {error}")
+            logging.debug(traceback.format_exc())
+
+    async def toggle_app_service_slot(self, app, slot, action):
+        """
+        START/STOP an Azure App Service Slot
+        """
+        url = f"{self.url}/{app}/slots/{slot}/{action}"
+        params = {"api-version": "2016-08-01"}
+
+        try:
+            poller = Poller(deadline=30)
+            await self.send_action(url, params, poller)
+            logging.info(f"Sent {action} to {slot}")
+            self.cache.invalidate(f"{self.url}/{app}/slots/{slot}")
+
+            async def get_state():
+                return (await self.get_app_service_slot(app, slot, max_age=0))["state"]
+
+            return await self.wait_for_state(get_state, slot, action, poller)
+        except Exception as error:
+            logging.error(f"Failed to {action} {slot}: {error}")
+            logging.debug(traceback.format_exc())
+
+
+class AsyncStreamAnalyticsJobs(AsyncAzureExtras):
+    def __init__(self, path, rg, concurrency=20):
+        super().__init__(StreamAnalyticsJobs(path, rg, concurrency), concurrency)
+
+    async def get_stream_analytics_job(self, job, expand=True, max_age=0):
+        """
+        Get a Stream Analytics job, with its inputs, transformation, outputs
+        and functions unless expand is False, which is all status checks
+        need. Served from the shared state cache when it is younger than
+        max_age seconds (never by default), and revalidated with its ETag
+        otherwise.
+        """
+        url = f"{self.url}/{job}"
+        params = {"api-version": "2015-10-01"}
+        if expand:
+            params["$expand"] = "inputs,transformation,outputs,functions"
+        status, reason, body = await self.cache.get_async(
+            self.fetch, url, self.headers, params, max_age
+        )
+        logging.debug(json.dumps(body))
+        if status >= 400:
+            raise AssertionError(
+                f"Failed to get {job} status from {url}\n"
+                + f"Response Code: {status}\n"
+                + f"Response Reason: {reason}"
+            )
+        return body
+
+    async def toggle_stream_analytics_job(self, job, action):
+        url = f"{self.url}/{job}/{action}"
+        params = {"api-version": "2015-10-01"}
+
+        poller = Poller(deadline=120, delay=2, max_delay=20)
+        await self.send_action(url, params, poller)
+        logging.info(f"Sent {action} to {job}")
+        self.cache.invalidate(f"{self.url}/{job}")
+        results = {}
+
+        async def get_state():
+            nonlocal results
+            results = await self.get_stream_analytics_job(job, expand=False, max_age=0)
+            return results["properties"]["jobState"]
+
+        await self.wait_for_state(get_state, job, action, poller)
+        logging.info(f"Successfully sent {action} to {job}.")
+        return results
+
+
+class AsyncKuduClient(AsyncAzureExtras):
+    """
+    https://github.com/projectkudu/kudu/wiki/REST-API
+
+    Kudu authenticates with the publishing credentials in the scm URI, so
+    none of the ARM headers are sent to it.
+    """
+
+    def __init__(self, path, rg, app, concurrency=20):
+        super().__init__(KuduClient(path, rg, app, concurrency), concurrency)
+        self.app = app
+
+    @property
+    def headers(self):
+        return {}
+
+    async def get_endpoint(self, endpoint):
+        status, reason, body = await self.request("GET", self.url + endpoint)
+        if status >= 400:
+            raise AssertionError(
+                f"Failed to get {endpoint} on {self.url}\n" + f"Code:{status}\n"
+            )
+        logging.debug("Output:\n" + json.dumps(body, indent=2, sort_keys=True))
+        return body
+
+    async def run_cmd(self, cmd, cwd):
+        logging.debug(f"Running {cmd} on {self.app}/{cwd}...")
+        payload = {"command": cmd, "dir": cwd}
+        status, reason, body = await self.request(
+            "POST", self.url + "command", json=payload
+        )
+        if status >= 400:
+            raise AssertionError(
+                f"Failed to run {cmd} on {self.url}/{cwd}\n" + f"Code:{status}\n"
+            )
+        logging.debug("Output:\n" + json.dumps(body, indent=2, sort_keys=True))
+        return body
+
+    async def deploy_zip(self, path):
+        """
+        https://github.com/projectkudu/kudu/wiki/REST-API#zip-deployment
+        """
+        url = self.url + "zipdeploy?isAsync=true"
+        span = get_tracer().start("PUT", url)
+        async with self.semaphore:
+            with open(path, "rb") as f:
+                async with self.session.put(url, data=f) as r:
+                    if span:
+                        span.finish(r.status, r.headers, os.path.getsize(path), 0)
+                    if r.status >= 400:
+                        raise AssertionError(
+                            f"Deploying {path} on {self.url}zipdeploy\n"
+                            + f"Code:{r.status}, Message: {await r.text()}"
+                        )
+                    location = r.headers["Location"]
+
+        async def check():
+            logging.debug(f"Checking deployment {location}")
+            status, reason, body = await self.request("GET", location)
+            return body.get("complete", False), body, None
+
+        done, body = await Poller(deadline=60, delay=2).wait_async(check)
+        if done:
+            return body
+
+        raise AssertionError(f"Timed out deploying {path} on {self.url}zipdeploy")
+
+    async def download_zip(self, source, destination, chunk_size=1024 * 1024):
+        """
+        https://github.com/projectkudu/kudu/wiki/REST-API#zip
+        """
+        url = f"{self.url}zip/{source}"
+        span = get_tracer().start("GET", url)
+        async with self.semaphore:
+            async with self.session.get(url) as response:
+                if response.status >= 400:
+                    if span:
+                        span.finish(response.status, response.headers, 0, 0)
+                    raise AssertionError(
+                        f"Failed to download zip from {url}: {response.status}"
+                    )
+                received = 0
+                with open(destination, "wb") as f:
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        f.write(chunk)
+                        received += len(chunk)
+                if span:
+                    span.finish(response.status, response.headers, 0, received)
+                return response.status
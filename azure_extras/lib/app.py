@@ -1,14 +1,15 @@
 import json
 import logging
-import requests
 import traceback
-from time import time
 from .az import AzureExtras
+from .poll import Poller
+
+HEALTH_CHECK_PATHS = {"enable": "/status/status.cshtml", "disable": "null"}
 
 
 class AppService(AzureExtras):
-    def __init__(self, path, rg):
-        super().__init__(path, rg)
+    def __init__(self, path, rg, pool_size=10):
+        super().__init__(path, rg, pool_size)
         self.url = f"{self.url}/providers/Microsoft.Web/sites"
 
     def get_publishing_credentials(self, app):
@@ -19,9 +20,10 @@ class AppService(AzureExtras):
         params = {"api-version": "2019-08-01"}
 
         try:
-            response = requests.post(url, headers=self.headers, params=params)
+            response = self.session.post(url, headers=self.headers, params=params)
             if response.ok:
-                logging.debug(json.dumps(response.json(), indent=2))
+                # The response holds the deployment password, so don't log it.
+                logging.debug(f"Got publishing credentials for {app}")
                 return response.json()["properties"]
             raise AssertionError(
                 f"Failed to get publishing credentials for {app}: {response.status_code}"
@@ -34,15 +36,12 @@ class AppService(AzureExtras):
         url = f"{self.url}/{app}/config/web"
         params = {"api-version": "2018-02-01"}
 
-        if action == "enable":
-            patch = {"properties": {"healthCheckPath": "/status/status.cshtml"}}
-        elif action == "disable":
-            patch = {"properties": {"healthCheckPath": "null"}}
-        else:
+        if action not in HEALTH_CHECK_PATHS:
             raise ValueError(f"{action} is invalid!")
+        patch = {"properties": {"healthCheckPath": HEALTH_CHECK_PATHS[action]}}
 
         try:
-            response = requests.patch(
+            response = self.session.patch(
                 url, headers=self.headers, params=params, data=json.dumps(patch)
             )
             if response.ok is False:
@@ -57,32 +56,45 @@ class AppService(AzureExtras):
             logging.debug(json.dumps(content, indent=2, sort_keys=True))
             if success is False:
                 raise AssertionError(f"Failed to patch {url} with {patch}.")
-        except requests.exceptions.ConnectionError as error:
-            logging.warning("Transient connection issue. Trying again...")
-            logging.debug(error)
-            timeout = time() + 10
-            while time() < timeout:
-                return self.toggle_health_check(app, action)
         except Exception as error:
             logging.debug(traceback.format_exc())
             raise error
 
-    def get_app_service(self, app):
+    def get_app_service(self, app, max_age=0):
         """
         Get App Service
+
+        Served from the shared state cache when it is younger than max_age
+        seconds (never by default), and revalidated with its ETag otherwise.
         """
         url = f"{self.url}/{app}"
         params = {"api-version": "2019-08-01"}
 
         try:
-            response = requests.get(url, headers=self.headers, params=params)
-            if response.ok:
-                return response.json()["properties"]
-            raise AssertionError(f"Failed to get {app}: {response.status_code}")
+            status, reason, body = self.cache.get(
+                self.session, url, self.headers, params, max_age
+            )
+            if status < 400:
+                return body["properties"]
+            raise AssertionError(f"Failed to get {app}: {status}")
         except Exception as error:
             logging.error(f"Failed to get status of {app}: {error}")
             logging.debug(traceback.format_exc())
 
+    def list_app_service_instances(self, app):
+        """
+        https://docs.microsoft.com/en-us/rest/api/appservice/webapps/listinstanceidentifiers
+        """
+        url = f"{self.url}/{app}/instances"
+        params = {"api-version": "2019-08-01"}
+
+        response = self.session.get(url, headers=self.headers, params=params)
+        if response.ok is False:
+            raise AssertionError(
+                f"Failed to get instances for {app}: {response.status_code}"
+            )
+        return [instance["name"] for instance in response.json()["value"]]
+
     def list_app_service_slots(self, app):
         """
         List App Service Slots
@@ -91,7 +103,7 @@ class AppService(AzureExtras):
         params = {"api-version": "2019-08-01"}
 
         try:
-            response = requests.get(url, headers=self.headers, params=params)
+            response = self.session.get(url, headers=self.headers, params=params)
             if response.ok:
                 return response.json()
             raise AssertionError(
@@ -101,18 +113,23 @@ class AppService(AzureExtras):
             logging.error(f"Failed to get slots for {app}: {error}")
             logging.debug(traceback.format_exc())
 
-    def get_app_service_slot(self, app, slot):
+    def get_app_service_slot(self, app, slot, max_age=0):
         """
         Get App Service Slot
+
+        Served from the shared state cache when it is younger than max_age
+        seconds (never by default), and revalidated with its ETag otherwise.
         """
         url = f"{self.url}/{app}/slots/{slot}"
         params = {"api-version": "2019-08-01"}
 
         try:
-            response = requests.get(url, headers=self.headers, params=params)
-            if response.ok:
-                return response.json()["properties"]
-            raise AssertionError(f"Failed to get {slot}: {response.status_code}")
+            status, reason, body = self.cache.get(
+                self.session, url, self.headers, params, max_age
+            )
+            if status < 400:
+                return body["properties"]
+            raise AssertionError(f"Failed to get {slot}: {status}")
         except Exception as error:
             logging.error(f"Failed to get status of {slot}: {error}")
             logging.debug(traceback.format_exc())
@@ -126,29 +143,31 @@ class AppService(AzureExtras):
         params = {"api-version": "2016-08-01"}
 
         try:
-            response = requests.post(url, headers=self.headers, params=params)
+            response = self.session.post(url, headers=self.headers, params=params)
             if response.ok is False:
                 raise AssertionError(
                     f"Failed to {action} {app}: {response.status_code}"
                 )
 
             logging.info(f"Sent {action.capitalize()} to {app}")
+            self.cache.invalidate(f"{self.url}/{app}")
+
+            # Raises straight away if the operation fails, and shares its
+            # deadline with the state checks below.
+            poller = Poller(deadline=30)
+            poller.wait_for_operation(self.session, response, self.headers)
 
-            timeout = time() + 30
-            while time() < timeout:
-                status = self.get_app_service(app)["state"]
+            def check():
+                status = self.get_app_service(app, max_age=0)["state"]
                 started = status == "Running" and action == "start"
                 stopped = status == "Stopped" and action == "stop"
-                if started or stopped:
-                    return status
+                return started or stopped, status, None
+
+            done, status = poller.wait(check)
+            if done:
+                return status
 
             raise AssertionError(f"Failed to {action} {app}: {status}")
-        except requests.exceptions.ConnectionError as error:
-            logging.warning("Transient connection issue. Trying again...")
-            logging.debug(error)
-            timeout = time() + 10
-            while time() < timeout:
-                return self.toggle_app_service(app, action)
         except Exception as error:
             logging.error(f"Failed to {action} {app}: {error}")
             logging.debug(traceback.format_exc())
@@ -161,29 +180,150 @@ class AppService(AzureExtras):
         params = {"api-version": "2016-08-01"}
 
         try:
-            response = requests.post(url, headers=self.headers, params=params)
+            response = self.session.post(url, headers=self.headers, params=params)
             if response.ok is False:
                 raise AssertionError(
                     f"Failed to {action} {slot}: {response.status_code}"
                 )
 
             logging.info(f"Sent {action} to {slot}")
+            self.cache.invalidate(f"{self.url}/{app}/slots/{slot}")
+
+            # Raises straight away if the operation fails, and shares its
+            # deadline with the state checks below.
+            poller = Poller(deadline=30)
+            poller.wait_for_operation(self.session, response, self.headers)
 
-            timeout = time() + 30
-            while time() < timeout:
-                status = self.get_app_service_slot(app, slot)["state"]
+            def check():
+                status = self.get_app_service_slot(app, slot, max_age=0)["state"]
                 started = status == "Running" and action == "start"
                 stopped = status == "Stopped" and action == "stop"
-                if started or stopped:
-                    return status
+                return started or stopped, status, None
+
+            done, status = poller.wait(check)
+            if done:
+                return status
 
             raise AssertionError(f"Failed to {action} {slot}: {status}")
-        except requests.exceptions.ConnectionError as error:
-            logging.warning("Transient connection issue. Trying again...")
-            logging.debug(error)
-            timeout = time() + 10
-            while time() < timeout:
-                return self.toggle_app_service_slot(app, slot, action)
         except Exception as error:
             logging.error(f"Failed to {action} {slot}: {error}")
             logging.debug(traceback.format_exc())
+
+    def get_many(self, names, params=None):
+        """
+        Get many App Services, or slots named "app/slots/slot", using ARM batch
+        requests. Returns a dict of name to properties, or None on failure.
+        """
+        params = params or {"api-version": "2019-08-01"}
+        responses = self.batch(
+            [self.batch_request("GET", f"{self.url}/{name}", params) for name in names]
+        )
+        results = {}
+        for name, response in zip(names, responses):
+            if response and response["httpStatusCode"] < 400:
+                results[name] = response["content"]["properties"]
+            else:
+                code = response["httpStatusCode"] if response else None
+                logging.error(f"Failed to get status of {name}: {code}")
+                results[name] = None
+        return results
+
+    def list_app_service_slots_many(self, apps):
+        """
+        List the slots of many App Services using ARM batch requests.
+        """
+        params = {"api-version": "2019-08-01"}
+        responses = self.batch(
+            [
+                self.batch_request("GET", f"{self.url}/{app}/slots", params)
+                for app in apps
+            ]
+        )
+        results = {}
+        for app, response in zip(apps, responses):
+            if response and response["httpStatusCode"] < 400:
+                results[app] = response["content"]
+            else:
+                logging.error(f"Failed to get slots for {app}")
+                results[app] = {"value": []}
+        return results
+
+    def toggle_many(self, names, action, deadline=60):
+        """
+        START/STOP many App Services and/or "app/slots/slot" names with ARM
+        batch requests, then poll their state in batches. Returns a dict of
+        name to final state, or None for those that failed.
+        """
+        params = {"api-version": "2016-08-01"}
+        responses = self.batch(
+            [
+                self.batch_request("POST", f"{self.url}/{name}/{action}", params)
+                for name in names
+            ]
+        )
+        states = {}
+        pending = []
+        for name, response in zip(names, responses):
+            if response and response["httpStatusCode"] < 400:
+                logging.info(f"Sent {action.capitalize()} to {name}")
+                pending.append(name)
+            else:
+                logging.error(f"Failed to {action} {name}")
+                states[name] = None
+
+        wanted = "Running" if action == "start" else "Stopped"
+
+        def check():
+            for name, properties in self.get_many(pending).items():
+                states[name] = properties["state"] if properties else None
+                if states[name] == wanted:
+                    pending.remove(name)
+            return not pending, states, None
+
+        done, states = Poller(deadline=deadline).wait(check)
+        for name in pending:
+            logging.error(f"Failed to {action} {name}: {states[name]}")
+        return states
+
+    def start_many(self, names):
+        return self.toggle_many(names, "start")
+
+    def stop_many(self, names):
+        return self.toggle_many(names, "stop")
+
+    def select_app_services(self, tag=None, regex=None, state=None):
+        """
+        Return the names of App Services in the resource group with tag
+        ("name" or "name=value"), whose names match regex and, when given,
+        whose state is state (e.g. Running or Stopped).
+        """
+        apps = self.select_resources("Microsoft.Web/sites", tag, regex)
+        if state and apps:
+            states = self.get_many(apps)
+            apps = [
+                app
+                for app in apps
+                if states[app] and states[app]["state"].lower() == state.lower()
+            ]
+        return apps
+
+    def get_web_config_many(self, apps):
+        """
+        Get the web config of many App Services using ARM batch requests.
+        Returns a dict of app to config properties, or None on failure.
+        """
+        params = {"api-version": "2018-02-01"}
+        responses = self.batch(
+            [
+                self.batch_request("GET", f"{self.url}/{app}/config/web", params)
+                for app in apps
+            ]
+        )
+        results = {}
+        for app, response in zip(apps, responses):
+            if response and response["httpStatusCode"] < 400:
+                results[app] = response["content"]["properties"]
+            else:
+                logging.error(f"Failed to get web config for {app}")
+                results[app] = None
+        return results
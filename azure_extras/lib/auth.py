@@ -0,0 +1,386 @@
+import json
+import logging
+import os
+import traceback
+from configparser import ConfigParser
+from datetime import datetime
+from threading import Lock
+from time import time
+from .session import get_session
+from .utils import CACHE_DIR, get_cmd_stdout, read_cache, write_cache
+
+ARM_RESOURCE = "https://management.azure.com/"
+AUTHORITY_HOST = "login.microsoftonline.com"
+CACHE_PATH = os.path.join(CACHE_DIR, "tokens.json")
+# The Azure CLI's public client id, which its refresh tokens are issued to.
+CLI_CLIENT_ID = "04b07795-8ddb-461a-bbee-02f9e1bf7b46"
+# ARM accepts tokens for either audience, and the CLI asks for the second.
+ARM_SCOPES = (
+    "https://management.azure.com//.default",
+    "https://management.core.windows.net//.default",
+)
+
+_providers = {}
+_providers_lock = Lock()
+
+
+def get_config(path):
+    try:
+        config = ConfigParser()
+        config.read(path)
+        az = config["azure"]
+    except Exception as error:
+        logging.error(f"Failed to retrieve config from {path}. Aborting.")
+        logging.error(error)
+        az = None
+
+    if az:
+        logging.info(f"Found Azure configuration at {path}.")
+        return az["client"], az["secret"], az["tenant"], az["sub"]
+
+    logging.error(f"Failed to retrieve Azure details from {path}. Aborting.")
+
+
+def get_cli_dir():
+    return os.environ.get(
+        "AZURE_CONFIG_DIR", os.path.join(os.path.expanduser("~"), ".azure")
+    )
+
+
+def read_cli_file(name):
+    with open(os.path.join(get_cli_dir(), name), encoding="utf-8-sig") as f:
+        return json.load(f)
+
+
+def get_cli_profile():
+    """
+    Return the (tenant, subscription, user) of the default Azure CLI
+    subscription, read straight from azureProfile.json rather than loading
+    the CLI. user is a dict with the login's name and type.
+    """
+    profile = read_cli_file("azureProfile.json")
+
+    for sub in profile["subscriptions"]:
+        if sub.get("isDefault"):
+            return sub["tenantId"], sub["id"], sub.get("user", {})
+
+    raise AssertionError("No default subscription in Azure CLI profile.")
+
+
+def resource_scopes(resource):
+    """
+    Return the v2.0 scopes a token for resource may have been issued for.
+    """
+    scope = f"{resource}/.default"
+    return ARM_SCOPES if scope in ARM_SCOPES else (scope,)
+
+
+def find_cli_token(cache, username, tenant, scopes):
+    """
+    Return (access token, refresh token, account) for username from the
+    Azure CLI's MSAL token cache, where either token may be None.
+
+    https://github.com/AzureAD/microsoft-authentication-library-for-python/blob/dev/msal/token_cache.py
+    """
+    accounts = [
+        account
+        for account in cache.get("Account", {}).values()
+        if account.get("username", "").lower() == username.lower()
+        and (tenant is None or account.get("realm") == tenant)
+    ] or [
+        # Guest logins are filed under their home tenant.
+        account
+        for account in cache.get("Account", {}).values()
+        if account.get("username", "").lower() == username.lower()
+    ]
+    if not accounts:
+        raise AssertionError(f"No Azure CLI login for {username} in token cache.")
+    account = accounts[0]
+    home = account["home_account_id"]
+
+    access_tokens = [
+        entry
+        for entry in cache.get("AccessToken", {}).values()
+        if entry.get("home_account_id") == home
+        and (tenant is None or entry.get("realm") == tenant)
+        and any(scope in entry.get("target", "").lower().split() for scope in scopes)
+    ]
+    access_token = max(
+        access_tokens, key=lambda entry: float(entry["expires_on"]), default=None
+    )
+    refresh_token = next(
+        (
+            entry
+            for entry in cache.get("RefreshToken", {}).values()
+            if entry.get("home_account_id") == home
+            and entry.get("client_id") == CLI_CLIENT_ID
+        ),
+        None,
+    )
+    return access_token, refresh_token, account
+
+
+def request_token(tenant, data, authority=AUTHORITY_HOST):
+    """
+    https://learn.microsoft.com/en-us/entra/identity-platform/v2-oauth2-client-creds-grant-flow
+    https://learn.microsoft.com/en-us/entra/identity-platform/v2-oauth2-auth-code-flow#refresh-the-access-token
+
+    Return (access token, expires on) from the token endpoint for a client
+    credentials or refresh token grant.
+    """
+    response = get_session().post(
+        f"https://{authority}/{tenant}/oauth2/v2.0/token", data=data
+    )
+    if response.ok is False:
+        try:
+            error = response.json().get("error_description", "").splitlines()[0]
+        except (ValueError, IndexError):
+            error = ""
+        raise AssertionError(
+            f"Failed to get a token from {authority}: {response.status_code} {error}"
+        )
+    token = response.json()
+    return token["access_token"], time() + float(token["expires_in"])
+
+
+class TokenProvider:
+    """
+    Hands out bearer tokens for one config path and resource.
+
+    Tokens are kept in memory and in an on-disk cache keyed by the identity
+    they were issued to (the CLI user or service principal) along with
+    tenant/subscription/resource, and are refreshed once they are within
+    refresh_margin seconds of expiring. Tokens for an identity that can't be
+    told apart from others are only kept in memory. Use get_token_provider() so every
+    client in the process shares one provider.
+    """
+
+    def __init__(self, config_path, resource=ARM_RESOURCE, refresh_margin=300):
+        self.config_path = config_path
+        self.resource = resource
+        self.refresh_margin = refresh_margin
+        self.cache_path = CACHE_PATH
+        self.tenant = None
+        self.subscription = None
+        self.user = None
+        self.source = None
+        self.identity = None
+        self.profile = None
+        self.token = None
+        self.expires_on = 0
+        self.lock = Lock()
+
+    @property
+    def cache_key(self):
+        return (
+            f"{self.source}:{self.identity}@"
+            + f"{self.tenant}/{self.subscription}/{self.resource}"
+        )
+
+    def get_subscription(self):
+        if self.subscription is None:
+            self.resolve_account()
+        return self.subscription
+
+    def resolve_account(self):
+        try:
+            self.profile = get_cli_profile()
+            self.tenant, self.subscription, self.user = self.profile
+            self.source, self.identity = "cli", self.user.get("name")
+            return
+        except Exception as error:
+            logging.debug(f"Couldn't read Azure CLI profile: {error}")
+
+        try:
+            # azure.common pulls in msrestazure and adal, so only import it
+            # when the CLI profile couldn't be read directly.
+            from azure.common.credentials import get_azure_cli_credentials
+
+            credentials = get_azure_cli_credentials(with_tenant=True)
+            self.subscription, self.tenant = credentials[1:]
+            self.source, self.identity = "cli", None
+            return
+        except Exception:
+            logging.warning("Couldn't get subscription id from Azure CLI.")
+
+        try:
+            client, secret, self.tenant, self.subscription = get_config(
+                self.config_path
+            )
+            self.source, self.identity = "sp", client
+        except Exception:
+            logging.error("Failed to get a subscription id.")
+
+    def refresh(self):
+        """
+        Forget the account and token if the default Azure CLI subscription or
+        login has changed since they were resolved, e.g. by az account set or
+        az login, so the next token is for the new one.
+        """
+        with self.lock:
+            if self.subscription is None:
+                return
+            try:
+                profile = get_cli_profile()
+            except Exception:
+                profile = None
+            if profile == self.profile:
+                return
+
+            logging.info("Azure CLI account changed, resolving it again.")
+            self.tenant = self.subscription = self.user = None
+            self.source = self.identity = self.profile = None
+            self.token, self.expires_on = None, 0
+
+    def expired(self, expires_on):
+        return time() > expires_on - self.refresh_margin
+
+    def get_token(self):
+        with self.lock:
+            if self.token and not self.expired(self.expires_on):
+                return self.token
+
+            if self.subscription is None:
+                self.resolve_account()
+
+            cached = self.read_cache().get(self.cache_key) if self.identity else None
+            if cached and not self.expired(cached["expires_on"]):
+                logging.debug(f"Using cached access token for {self.cache_key}")
+                self.token, self.expires_on = cached["token"], cached["expires_on"]
+                return self.token
+
+            self.token, self.expires_on = self.fetch_token()
+            if self.identity:
+                self.write_cache()
+            return self.token
+
+    def fetch_token(self):
+        if self.source != "sp":
+            try:
+                token = self.fetch_cli_token()
+                logging.info("Authenticated with Azure CLI credentials.")
+                return token
+            except Exception as error:
+                logging.debug(f"Couldn't use Azure CLI token cache: {error}")
+
+            try:
+                token = self.run_cli()
+                logging.info("Authenticated with Azure CLI credentials.")
+                return token
+            except Exception:
+                logging.warning("Failed to authenticate using Azure CLI credentials.")
+
+        try:
+            client, secret, tenant, sub = get_config(self.config_path)
+            token = self.client_credentials(client, secret, tenant)
+            # Cache the token under the identity that was actually used.
+            self.source, self.identity, self.tenant = "sp", client, tenant
+            logging.info(
+                f"Authenticated with Service Principal credentials from {self.config_path}"
+            )
+            return token
+        except Exception as error:
+            logging.debug(traceback.format_exc())
+            raise error
+
+    def fetch_cli_token(self):
+        """
+        Return a token for the Azure CLI's login from its MSAL cache, using
+        its refresh token if the cached access token is about to expire, the
+        way az account get-access-token would but without running it.
+        """
+        user = self.user or {}
+        if user.get("type") == "servicePrincipal":
+            # az login --service-principal keeps the secret alongside the cache.
+            for entry in read_cli_file("service_principal_entries.json"):
+                if entry.get("client_id") == user["name"] and "client_secret" in entry:
+                    return self.client_credentials(
+                        entry["client_id"], entry["client_secret"], entry["tenant"]
+                    )
+            raise AssertionError(f"No secret for service principal {user['name']}")
+
+        cache = read_cli_file("msal_token_cache.json")
+        scopes = resource_scopes(self.resource)
+        access_token, refresh_token, account = find_cli_token(
+            cache, user["name"], self.tenant, scopes
+        )
+        if access_token and not self.expired(float(access_token["expires_on"])):
+            logging.debug(f"Using Azure CLI's cached access token for {user['name']}")
+            return access_token["secret"], float(access_token["expires_on"])
+        if refresh_token is None:
+            raise AssertionError(f"No refresh token for {user['name']}, run az login.")
+
+        logging.debug(f"Refreshing Azure CLI access token for {user['name']}")
+        # The rotated refresh token isn't written back, as the cache is the
+        # CLI's, but the old one stays valid until it expires.
+        return request_token(
+            self.tenant or account["realm"],
+            {
+                "grant_type": "refresh_token",
+                "client_id": CLI_CLIENT_ID,
+                "refresh_token": refresh_token["secret"],
+                "scope": f"{scopes[0]} offline_access",
+            },
+            account.get("environment", AUTHORITY_HOST),
+        )
+
+    def run_cli(self):
+        """
+        Fall back to running the Azure CLI, for token caches it encrypts
+        (Windows) or older CLIs that predate MSAL.
+        """
+        token = json.loads(
+            get_cmd_stdout(f"az account get-access-token --resource {self.resource}")
+        )
+        if "expires_on" in token:
+            expires_on = float(token["expires_on"])
+        else:
+            expires_on = datetime.strptime(
+                token["expiresOn"], "%Y-%m-%d %H:%M:%S.%f"
+            ).timestamp()
+        return token["accessToken"], expires_on
+
+    def client_credentials(self, client, secret, tenant):
+        return request_token(
+            tenant,
+            {
+                "grant_type": "client_credentials",
+                "client_id": client,
+                "client_secret": secret,
+                "scope": resource_scopes(self.resource)[0],
+            },
+        )
+
+    def read_cache(self):
+        return read_cache(self.cache_path)
+
+    def write_cache(self):
+        cache = {
+            key: entry
+            for key, entry in self.read_cache().items()
+            if not self.expired(entry["expires_on"])
+        }
+        cache[self.cache_key] = {"token": self.token, "expires_on": self.expires_on}
+        write_cache(self.cache_path, cache)
+
+
+def get_token_provider(config_path, resource=ARM_RESOURCE):
+    """
+    Return the process wide TokenProvider for config_path and resource.
+    """
+    key = (config_path, resource)
+    with _providers_lock:
+        if key not in _providers:
+            _providers[key] = TokenProvider(config_path, resource)
+        return _providers[key]
+
+
+def refresh_token_providers():
+    """
+    Have every TokenProvider pick up Azure CLI account changes. Providers
+    live as long as the process, which for the daemon spans many commands.
+    """
+    with _providers_lock:
+        providers = list(_providers.values())
+    for provider in providers:
+        provider.refresh()
@@ -1,85 +1,145 @@
-import json
 import logging
-import subprocess
-import traceback
-from configparser import ConfigParser
-from azure.common.credentials import (
-    ServicePrincipalCredentials,
-    get_azure_cli_credentials,
-)
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from .auth import get_config, get_token_provider
+from .cache import get_state_cache
+from .poll import Poller
+from .session import ARM_HOST, get_session
 
-
-def get_cmd_stdout(cmd):
-    process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE)
-    process.wait()
-    data, err = process.communicate()
-    return data.decode("utf-8")
+BATCH_SIZE = 20
+BATCH_URL = f"https://{ARM_HOST}/batch"
 
 
 class AzureExtras:
-    def __init__(self, path, rg):
+    def __init__(self, path, rg, pool_size=10):
         self.config_path = path
+        self.session = get_session(pool_size)
+        self.cache = get_state_cache()
+        self.tokens = get_token_provider(path)
         sub = self.get_subscription()
-        token = self.get_access_token()
-        self.headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-        }
         self.url = (
             f"https://management.azure.com/subscriptions/{sub}/resourceGroups/{rg}"
         )
-        logging.debug("HEADERS:\n" + json.dumps(self.headers))
+        self.rg_url = self.url
+        logging.debug(f"Using {self.tokens.source} credentials for {self.url}")
+
+    @property
+    def headers(self):
+        """
+        Request headers carrying a bearer token that is refreshed as it nears
+        expiry, so long running fleet operations don't fail partway through.
+        """
+        return {
+            "Authorization": f"Bearer {self.get_access_token()}",
+            "Content-Type": "application/json",
+        }
 
     def get_config(self, path):
-        try:
-            config = ConfigParser()
-            config.read(path)
-            az = config["azure"]
-        except Exception as error:
-            logging.error(f"Failed to retrieve config from {path}. Aborting.")
-            logging.error(error)
+        return get_config(path)
 
-        if az:
-            logging.info(f"Found Azure configuration at {path}.")
-            return az["client"], az["secret"], az["tenant"], az["sub"]
+    def get_subscription(self):
+        return self.tokens.get_subscription()
 
-        logging.error(f"Failed to retrieve Azure details from {path}. Aborting.")
+    def get_access_token(self):
+        return self.tokens.get_token()
 
-    def get_subscription(self):
-        try:
-            return get_azure_cli_credentials()[1]
-        except Exception as error:
-            logging.warning("Couldn't get subscription id from Azure CLI.")
+    def batch(self, requests):
+        """
+        https://docs.microsoft.com/en-us/rest/api/resources/batch
 
-        try:
-            client, secret, tenant, sub = self.get_config(self.config_path)
-            return sub
-        except Exception as error:
-            logging.error("Failed to get a subscription id.")
+        Send many ARM requests packed into $batch calls of up to BATCH_SIZE
+        requests each, with the batches themselves sent concurrently. Each
+        request is a dict with httpMethod, url and optionally content, and
+        responses come back in the same order.
+        """
+        requests = [dict(request, name=str(i)) for i, request in enumerate(requests)]
+        chunks = [
+            requests[i : i + BATCH_SIZE] for i in range(0, len(requests), BATCH_SIZE)
+        ]
+        if not chunks:
+            return []
 
-    def get_access_token(self):
-        try:
-            access_token = json.loads(get_cmd_stdout("az account get-access-token"))[
-                "accessToken"
-            ]
-            logging.info("Authenticated with Azure CLI credentials.")
-            return access_token
-        except Exception as error:
-            logging.warning("Failed to authenticate using Azure CLI credentials.")
-
-        try:
-            client, secret, tenant, sub = self.get_config(self.config_path)
-            credentials = ServicePrincipalCredentials(
-                client_id=client,
-                secret=secret,
-                tenant=tenant,
-            )
-            access_token = credentials.token["access_token"]
-            logging.info(
-                f"Authenticated with Service Principal credentials from {self.config_path}"
+        with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            results = executor.map(self.send_batch, chunks)
+
+        responses = {r["name"]: r for chunk in results for r in chunk}
+        return [responses.get(request["name"]) for request in requests]
+
+    def send_batch(self, requests):
+        response = self.session.post(
+            BATCH_URL,
+            headers=self.headers,
+            params={"api-version": "2020-06-01"},
+            json={"requests": requests},
+        )
+        if response.ok is False:
+            raise AssertionError(
+                f"Failed to send batch of {len(requests)} requests: "
+                + f"{response.status_code}"
             )
-            logging.debug(f"Access Token:\n\n{access_token}\n")
-            return access_token
-        except Exception as error:
-            logging.debug(traceback.format_exc())
-            raise error
+
+        # Batches that take too long are finished asynchronously, in which
+        # case the Location header points at the eventual results.
+        done, body = Poller(deadline=60).wait_for_operation(
+            self.session, response, self.headers
+        )
+        if done is False:
+            raise AssertionError(f"Timed out waiting for batch of {len(requests)}")
+        body = body if body is not None else response.json()
+        logging.debug(f"Batch of {len(requests)} requests returned")
+        return body["responses"]
+
+    def batch_request(self, method, url, params):
+        """
+        Build a $batch entry for an absolute ARM url.
+        """
+        path = url.split(ARM_HOST, 1)[1]
+        return {"httpMethod": method, "url": f"{path}?{urlencode(params)}"}
+
+    def list_resources(self, resource_type, tag=None):
+        """
+        https://docs.microsoft.com/en-us/rest/api/resources/resources/listbyresourcegroup
+
+        Yield the resources of resource_type in the resource group, following
+        nextLink pages. tag is "name" or "name=value" and is filtered on by
+        ARM, which can't combine it with a type filter, so the type is then
+        checked here instead.
+        """
+        if tag:
+            # OData string literals escape a quote by doubling it.
+            name, _, value = tag.replace("'", "''").partition("=")
+            odata = f"tagName eq '{name}'"
+            if value:
+                odata += f" and tagValue eq '{value}'"
+        else:
+            odata = f"resourceType eq '{resource_type}'"
+
+        url = f"{self.rg_url}/resources"
+        params = {"api-version": "2021-04-01", "$filter": odata}
+        while url:
+            response = self.session.get(url, headers=self.headers, params=params)
+            if response.ok is False:
+                raise AssertionError(
+                    f"Failed to list {resource_type} resources: {response.status_code}"
+                )
+            body = response.json()
+            for resource in body["value"]:
+                if resource["type"].lower() == resource_type.lower():
+                    yield resource
+            # nextLink already carries the query string.
+            url, params = body.get("nextLink"), None
+
+    def select_resources(self, resource_type, tag=None, regex=None):
+        """
+        Return the names of resources of resource_type with tag whose names
+        match the regular expression regex.
+        """
+        pattern = re.compile(regex) if regex else None
+        names = [
+            resource["name"]
+            for resource in self.list_resources(resource_type, tag)
+            if pattern is None or pattern.search(resource["name"])
+        ]
+        logging.info(f"Selected {len(names)} {resource_type} resources")
+        return names
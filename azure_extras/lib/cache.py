@@ -0,0 +1,135 @@
+import logging
+from collections import OrderedDict
+from copy import deepcopy
+from threading import Lock
+from time import time
+from urllib.parse import urlencode
+
+_cache = None
+_lock = Lock()
+
+
+class StateCache:
+    """
+    Read-through cache for ARM GETs.
+
+    Responses younger than max_age seconds (ttl when not given, which is 0
+    unless set) are served from memory. Older ones are revalidated with
+    If-None-Match when ARM gave us an ETag, so a 304 costs a round trip but
+    no payload. Writes should invalidate the urls they affect.
+
+    At most max_entries responses are kept, dropping the least recently used
+    first, and callers always get their own copy of a cached body.
+    """
+
+    def __init__(self, ttl=0, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def key(self, url, params):
+        return f"{url}?{urlencode(sorted((params or {}).items()))}"
+
+    def get(self, session, url, headers=None, params=None, max_age=None):
+        """
+        Return a (status, reason, body) tuple for url, where body is the
+        decoded json response or an empty dict.
+        """
+        key = self.key(url, params)
+        entry = self.lookup(key, max_age)
+        if entry and entry["fresh"]:
+            return 200, "OK", deepcopy(entry["body"])
+
+        response = session.get(
+            url, headers=self.revalidate(entry, headers), params=params
+        )
+        body = response.json() if response.content else {}
+        return self.store(
+            key, entry, response.status_code, response.reason, response.headers, body
+        )
+
+    async def get_async(self, fetch, url, headers=None, params=None, max_age=None):
+        """
+        Coroutine version of get(), where fetch is a coroutine function like
+        AsyncAzureExtras.fetch returning a (response, body) tuple.
+        """
+        key = self.key(url, params)
+        entry = self.lookup(key, max_age)
+        if entry and entry["fresh"]:
+            return 200, "OK", deepcopy(entry["body"])
+
+        response, body = await fetch(
+            "GET", url, headers=self.revalidate(entry, headers), params=params
+        )
+        return self.store(
+            key, entry, response.status, response.reason, response.headers, body
+        )
+
+    def lookup(self, key, max_age):
+        """
+        Return the cached entry for key, if any, with fresh set when it is
+        younger than max_age seconds and can be served as is.
+        """
+        max_age = self.ttl if max_age is None else max_age
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+        fresh = time() - entry["fetched"] < max_age
+        if fresh:
+            self.hits += 1
+        return dict(entry, fresh=fresh)
+
+    def revalidate(self, entry, headers):
+        headers = dict(headers or {})
+        if entry and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        return headers
+
+    def store(self, key, entry, status, reason, headers, body):
+        if status == 304 and entry:
+            self.revalidated += 1
+            with self.lock:
+                if key in self.entries:
+                    self.entries[key]["fetched"] = time()
+            return 200, "OK", deepcopy(entry["body"])
+
+        self.misses += 1
+        if 200 <= status < 300:
+            with self.lock:
+                self.entries[key] = {
+                    "etag": headers.get("ETag"),
+                    "body": deepcopy(body),
+                    "fetched": time(),
+                }
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return status, reason, body
+
+    def invalidate(self, url):
+        """
+        Forget every cached response for url and anything below it.
+        """
+        with self.lock:
+            for key in list(self.entries):
+                if key.startswith(f"{url}?") or key.startswith(f"{url}/"):
+                    del self.entries[key]
+        logging.debug(f"Invalidated cached state for {url}")
+
+
+def get_state_cache():
+    """
+    Return the process wide StateCache.
+    """
+    global _cache
+
+    with _lock:
+        if _cache is None:
+            _cache = StateCache()
+    return _cache
@@ -0,0 +1,317 @@
+import atexit
+import ctypes
+import io
+import json
+import logging
+import os
+import socketserver
+import sys
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+from importlib import import_module
+from threading import Lock, Thread, get_ident
+from time import sleep, time
+from .auth import refresh_token_providers
+from .cache import get_state_cache
+from .rpc import COMMANDS, LONG_RUNNING, SOCKET_PATH, connect, send
+from .session import get_session
+from .trace import JsonLinesHook, SummaryHook, get_tracer
+
+
+class SocketStream(io.TextIOBase):
+    """
+    Text stream that sends whatever is written to it to a client, as json
+    messages keyed by name (stdout or stderr).
+    """
+
+    def __init__(self, sock, name, lock):
+        self.sock = sock
+        self.name = name
+        self.lock = lock
+        self.connected = True
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if text and self.connected:
+            try:
+                with self.lock:
+                    send(self.sock, {self.name: text})
+            except OSError:
+                # The client went away, but let the command finish.
+                self.connected = False
+        return len(text)
+
+
+class HangupWatch:
+    """
+    Raises KeyboardInterrupt in the thread that made it if the client hangs
+    up before stop() is called, so interrupting a client cancels its command.
+    Like Ctrl-C, it only lands between Python bytecodes, so a blocking call
+    finishes first.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.thread = get_ident()
+        self.lock = Lock()
+        self.stopped = False
+        self.fired = False
+        Thread(target=self.watch, daemon=True).start()
+
+    def watch(self):
+        try:
+            # Clients send nothing after their request, so this only returns
+            # once they hang up.
+            while self.sock.recv(1024):
+                pass
+        except OSError:
+            pass
+        with self.lock:
+            if self.stopped:
+                return
+            self.fired = True
+            ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                ctypes.c_ulong(self.thread), ctypes.py_object(KeyboardInterrupt)
+            )
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            if self.fired:
+                # Drop the interrupt if it hasn't been raised yet.
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                    ctypes.c_ulong(self.thread), None
+                )
+
+
+def exit_code(exit):
+    """
+    The status a process would exit with for a SystemExit, printing its
+    message like the interpreter does.
+    """
+    if exit.code is None:
+        return 0
+    if isinstance(exit.code, int):
+        return exit.code
+    print(exit.code, file=sys.stderr)
+    return 1
+
+
+class Daemon:
+    """
+    Runs CLI commands sent over a Unix socket in one long lived process, so
+    imports, tokens, connection pools and state caches are shared between
+    invocations instead of being rebuilt by each one.
+
+    Commands run one at a time, since each has the process's stdout, stderr,
+    logging and working directory to itself while it runs. The daemon stops
+    after idle_timeout seconds without a command, unless that's 0.
+    """
+
+    def __init__(self, path=SOCKET_PATH, idle_timeout=0):
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.lock = Lock()
+        self.server = None
+        self.started = time()
+        self.last_used = time()
+        self.served = 0
+        self.failed = 0
+
+    def run(self, command, argv, cwd, sock):
+        """
+        Run command's main() with argv from cwd, sending its output down
+        sock, and return its exit code, or None if argv makes it long running
+        and it should run in the client instead.
+        """
+        module = import_module(COMMANDS[command])
+        lock = Lock()
+        stdout = SocketStream(sock, "stdout", lock)
+        stderr = SocketStream(sock, "stderr", lock)
+
+        with self.lock:
+            if self.long_running(command, argv, cwd):
+                logging.info(f"Handing {command} {' '.join(argv)} back to run locally")
+                return None
+            logging.info(f"Running {command} {' '.join(argv)} in {cwd}")
+            handlers, level = logging.root.handlers[:], logging.root.level
+            for handler in handlers:
+                logging.root.removeHandler(handler)
+            previous_argv, previous_cwd = sys.argv, os.getcwd()
+            hooks = list(get_tracer().hooks)
+            sys.argv = [f"azure-extras {command}", *argv]
+            code = 1
+            hangup = HangupWatch(sock)
+            try:
+                with redirect_stdout(stdout), redirect_stderr(stderr):
+                    try:
+                        try:
+                            os.chdir(cwd)
+                            refresh_token_providers()
+                            module.main()
+                        finally:
+                            hangup.stop()
+                        code = 0
+                    except KeyboardInterrupt:
+                        code = 130
+                    except SystemExit as exit:
+                        code = exit_code(exit)
+                    except Exception:
+                        traceback.print_exc()
+                        code = 1
+                    finally:
+                        self.finish_tracing(hooks)
+            finally:
+                # Hand logging back from whatever mklog set up for the command.
+                for handler in logging.root.handlers[:]:
+                    logging.root.removeHandler(handler)
+                for handler in handlers:
+                    logging.root.addHandler(handler)
+                logging.root.setLevel(level)
+                sys.argv = previous_argv
+                os.chdir(previous_cwd)
+                self.served += 1
+                self.failed += 1 if code else 0
+                self.last_used = time()
+            if hangup.fired and code == 130:
+                logging.info(f"The client hung up, so {command} was cancelled")
+        return code
+
+    def long_running(self, command, argv, cwd):
+        """
+        Whether argv, parsed from cwd by the command's own parser, makes
+        command run until it is interrupted.
+        """
+        if command not in LONG_RUNNING:
+            return False
+        parser = import_module(COMMANDS[command]).get_parser()
+        previous_cwd = os.getcwd()
+        try:
+            # Bad arguments are left for the command to report.
+            with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+                os.chdir(cwd)
+                args, unknown = parser.parse_known_args(argv)
+        except SystemExit:
+            return False
+        finally:
+            os.chdir(previous_cwd)
+        return getattr(args, LONG_RUNNING[command]) is not None
+
+    def finish_tracing(self, hooks):
+        """
+        Flush and drop the trace hooks a command added, rather than leaving
+        them to exit, which for the daemon is much later.
+        """
+        tracer = get_tracer()
+        for hook in list(tracer.hooks):
+            if hook in hooks:
+                continue
+            if isinstance(hook, SummaryHook):
+                atexit.unregister(hook.print_table)
+                hook.print_table()
+            elif isinstance(hook, JsonLinesHook):
+                atexit.unregister(hook.close)
+                hook.close()
+            tracer.remove_hook(hook)
+
+    def status(self):
+        cache = get_state_cache()
+        return {
+            "pid": os.getpid(),
+            "socket": self.path,
+            "uptime": round(time() - self.started),
+            "served": self.served,
+            "failed": self.failed,
+            "busy": self.lock.locked(),
+            "cache": {
+                "entries": len(cache.entries),
+                "hits": cache.hits,
+                "revalidated": cache.revalidated,
+                "misses": cache.misses,
+            },
+        }
+
+    def watch_idle(self):
+        while True:
+            sleep(min(60, self.idle_timeout))
+            idle = time() - self.last_used
+            if idle > self.idle_timeout and not self.lock.locked():
+                logging.info(f"Idle for {idle:.0f}s, stopping")
+                self.server.shutdown()
+                return
+
+    def serve(self):
+        """
+        Listen on the socket until stopped, warming up every command's
+        imports and the shared session first.
+        """
+        if connect(self.path):
+            raise SystemExit(f"A daemon is already listening on {self.path}")
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+
+        for module in COMMANDS.values():
+            import_module(module)
+        get_session()
+
+        umask = os.umask(0o177)
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(self.path, Handler)
+        finally:
+            os.umask(umask)
+        self.server.daemon_threads = True
+        self.server.azure_extras = self
+        if self.idle_timeout:
+            Thread(target=self.watch_idle, daemon=True).start()
+
+        logging.info(f"Listening on {self.path}")
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """
+    Reads one json request per connection: a command with its argv and the
+    client's working directory, or status/stop for the daemon itself.
+    """
+
+    def handle(self):
+        daemon = self.server.azure_extras
+        try:
+            request = json.loads(self.rfile.readline())
+            command = request["command"]
+        except (ValueError, KeyError, TypeError) as error:
+            logging.warning(f"Bad request: {error}")
+            return
+
+        if command == "status":
+            send(self.connection, {"stdout": json.dumps(daemon.status()) + "\n"})
+            code = 0
+        elif command == "stop":
+            # shutdown() waits for serve_forever(), so can't be called here.
+            Thread(target=self.server.shutdown).start()
+            code = 0
+        elif command in COMMANDS:
+            code = daemon.run(
+                command, request.get("argv", []), request["cwd"], self.connection
+            )
+            if code is None:
+                send(self.connection, {"local": True})
+                return
+        else:
+            send(self.connection, {"stderr": f"Unknown command {command}\n"})
+            code = 2
+
+        try:
+            send(self.connection, {"exit": code})
+        except OSError:
+            logging.debug(f"Client went away before {command} finished")
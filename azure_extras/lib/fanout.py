@@ -0,0 +1,80 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from time import time
+
+
+def make_record(app, instance, cmd, cwd, error=""):
+    return {
+        "app": app,
+        "instance": instance,
+        "command": cmd,
+        "dir": cwd,
+        "exit_code": None,
+        "output": "",
+        "error": error,
+        "elapsed": 0,
+    }
+
+
+def run_on_instance(kudu, instance, cmd, cwd, timeout):
+    start = time()
+    record = make_record(kudu.app, instance, cmd, cwd)
+    try:
+        response = kudu.run_cmd(cmd, cwd, instance, timeout)
+        record.update(
+            exit_code=response.get("ExitCode"),
+            output=response.get("Output", ""),
+            error=response.get("Error", ""),
+        )
+    except Exception as error:
+        record["error"] = str(error)
+    record["elapsed"] = round(time() - start, 3)
+    return record
+
+
+def fan_out(registry, apps, cmd, cwd="site/wwwroot", workers=16, timeout=60):
+    """
+    Run cmd on every instance of every app and yield a record per instance
+    as soon as it finishes.
+
+    Instances are enumerated through the ARM instances API and targeted with
+    the ARRAffinity cookie. Listings and commands share one bounded pool, so
+    commands for an app start as soon as its instances are known, and each
+    command is given timeout seconds. Apps whose scm URI or instances can't
+    be found get a record with the error instead.
+    """
+    errors = {}
+    clients = registry.get_many(apps, errors)
+    for app, error in errors.items():
+        logging.error(error)
+        yield make_record(app, None, cmd, cwd, str(error))
+    app_service = registry.app_service
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        listings = {
+            executor.submit(app_service.list_app_service_instances, app): app
+            for app in clients
+        }
+        pending = set(listings)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future not in listings:
+                    yield future.result()
+                    continue
+
+                app = listings[future]
+                try:
+                    instances = future.result()
+                except Exception as error:
+                    logging.error(error)
+                    yield make_record(app, None, cmd, cwd, str(error))
+                    continue
+
+                logging.info(f"Found {len(instances)} instances of {app}")
+                for instance in instances:
+                    pending.add(
+                        executor.submit(
+                            run_on_instance, clients[app], instance, cmd, cwd, timeout
+                        )
+                    )
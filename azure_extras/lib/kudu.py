@@ -1,9 +1,41 @@
+import hashlib
 import json
 import logging
-import requests
+import os
+import random
+import re
 import traceback
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from time import sleep
 from .app import AppService
-from time import time
+from .poll import Poller
+from .transfer import CHUNK_SIZE, ProgressFile, download
+
+# Kept under /home/data rather than next to the files, so it isn't served.
+MANIFEST_DIR = "data/azure_extras/manifests"
+TAIL_BLOCK_SIZE = 64 * 1024
+
+
+def sha256sum(path, chunk_size=CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_kudu_time(timestamp):
+    """
+    Parse a VFS mtime such as 2020-06-01T10:11:12.1234567+00:00, trimming the
+    fractional seconds to the microseconds datetime can handle.
+    """
+    if "." in timestamp:
+        head, tail = timestamp.split(".", 1)
+        digits = len(tail) - len(tail.lstrip("0123456789"))
+        timestamp = f"{head}.{tail[:min(digits, 6)]}{tail[digits:]}"
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
 
 
 class KuduClient(AppService):
@@ -11,79 +43,257 @@ class KuduClient(AppService):
     https://github.com/projectkudu/kudu/wiki/REST-API
     """
 
-    def __init__(self, path, rg, app):
-        super().__init__(path, rg)
+    def __init__(self, path, rg, app, pool_size=10, scm_uri=None):
+        super().__init__(path, rg, pool_size)
         self.app = app
-        self.url = self.get_publishing_credentials(app)["scmUri"] + "/api/"
-        logging.debug(self.url)
+        if scm_uri is None:
+            scm_uri = self.get_publishing_credentials(app)["scmUri"]
+        self.url = scm_uri + "/api/"
 
     def convert_kudu_path(self, path):
         return path.replace("C:\\home\\", "").replace("\\", "/")
 
-    def check_directory_for_logs(self, directory, allfiles=[]):
-        logging.info(f"Checking {directory} for logfiles...")
-        response = requests.get(f"{self.url}vfs/{directory}")
-        logfiles = response.json()
-        for d in logfiles:
-            if d["mime"] == "inode/directory":
-                converted_path = self.convert_kudu_path(d["path"])
-                allfiles = allfiles + self.check_directory_for_logs(
-                    converted_path, allfiles
+    def list_directory(self, directory):
+        """
+        https://github.com/projectkudu/kudu/wiki/REST-API#vfs
+        """
+        logging.info(f"Checking {directory} for files...")
+        response = self.session.get(f"{self.url}vfs/{directory.rstrip('/')}/")
+        if response.ok is False:
+            raise AssertionError(
+                f"Failed to list {directory} on {self.url}: {response.status_code}"
+            )
+        return response.json()
+
+    def crawl(self, directory, extensions=None, since=None, workers=8):
+        """
+        Walk the VFS under directory breadth first, listing up to workers
+        directories concurrently, and yield file entries as they are found.
+
+        Entries are deduplicated by path, and can be restricted to names
+        ending in one of extensions and to files modified after since (an
+        aware datetime).
+        """
+        seen = {self.convert_kudu_path(directory)}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {executor.submit(self.list_directory, directory)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for entry in future.result():
+                        path = self.convert_kudu_path(entry["path"])
+                        if path in seen:
+                            continue
+                        seen.add(path)
+                        if entry["mime"] == "inode/directory":
+                            pending.add(executor.submit(self.list_directory, path))
+                        elif extensions and not entry["name"].endswith(extensions):
+                            continue
+                        elif since and parse_kudu_time(entry["mtime"]) < since:
+                            continue
+                        else:
+                            yield entry
+
+    def check_directory_for_logs(self, directory):
+        return list(self.crawl(directory, extensions=(".log", ".txt")))
+
+    def tail_file(self, path, size, line_count, block_size=TAIL_BLOCK_SIZE):
+        """
+        Return the last line_count lines of a VFS file of size bytes, reading
+        it backwards block_size bytes at a time with Range requests.
+        """
+        url = f"{self.url}vfs/{path}"
+        if not size:
+            response = self.session.get(url)
+            if response.ok is False:
+                raise AssertionError(
+                    f"Failed to read {path} on {self.url}: {response.status_code}"
                 )
-        allfiles = allfiles + logfiles
-        allfiles = [
-            d
-            for d in allfiles
-            if d["name"].endswith(".log") or d["name"].endswith(".txt")
-        ]
+            return response.text.split("\n")[-line_count:]
 
-        return allfiles
+        buffer = b""
+        end = size
+        while end > 0 and buffer.count(b"\n") <= line_count:
+            start = max(0, end - block_size)
+            headers = {"Range": f"bytes={start}-{end - 1}"}
+            response = self.session.get(url, headers=headers)
+            if response.ok is False:
+                raise AssertionError(
+                    f"Failed to read {path} on {self.url}: {response.status_code}"
+                )
+            if response.status_code != 206:
+                # Range not honoured, so we already have the whole file.
+                buffer, end = response.content, 0
+                break
+            buffer = response.content + buffer
+            end = start
 
-    def get_logs(self, line_count):
-        # response = requests.get(self.url + "logs/recent")
+        lines = buffer.split(b"\n")
+        if end > 0:
+            # The first line is most likely cut short by the block boundary.
+            lines = lines[1:]
+        if lines and lines[-1] == b"":
+            lines.pop()
+        return [line.decode("utf-8", "replace") for line in lines[-line_count:]]
+
+    def tail_logs(self, line_count):
+        """
+        Return the last line_count lines across all log files, newest last,
+        only fetching as much of the newest files as is needed.
+        """
         logfiles = self.check_directory_for_logs("LogFiles")
-        sorted_logfiles = sorted(logfiles, key=lambda d: d["mtime"])
-        logfile_count = 1
-        log_lines = []
+        log_lines = deque()
 
-        while len(log_lines) < line_count and logfile_count <= len(sorted_logfiles):
-            logpath = sorted_logfiles[len(sorted_logfiles) - logfile_count]["path"]
-            logdate = sorted_logfiles[len(sorted_logfiles) - logfile_count]["mtime"]
+        for logfile in sorted(logfiles, key=lambda d: d["mtime"], reverse=True):
+            if len(log_lines) >= line_count:
+                break
+            converted_path = self.convert_kudu_path(logfile["path"])
+            logging.info(
+                f"Pre-pending tail of {converted_path} from {logfile['mtime']}..."
+            )
+            lines = self.tail_file(
+                converted_path, logfile.get("size"), line_count - len(log_lines)
+            )
+            log_lines.extendleft(reversed(lines))
+            logging.debug(f"You now have {len(log_lines)}/{line_count} lines")
 
-            converted_path = self.convert_kudu_path(logpath)
-            logging.info(f"Pre-pending contents of {converted_path} from {logdate}...")
-            response = requests.get(f"{self.url}vfs/{converted_path}")
+        return list(log_lines)
 
-            lines = response.text.split("\n")
-            log_lines = lines + log_lines
-            logfile_count = logfile_count + 1
-            logging.debug(f"You now have {len(log_lines)}/{line_count} lines")
+    def get_logs(self, line_count):
+        print("\n".join(self.tail_logs(line_count)))
 
-        print("\n".join(log_lines[-line_count:]))
+    def follow_logs(self, path="", pattern=None, interval=5):
+        """
+        https://github.com/projectkudu/kudu/wiki/Diagnostic-Log-Stream
+
+        Yield log lines as they are written, optionally only those matching
+        the regular expression pattern. Lines come from a long lived
+        logstream connection, which is re-opened with backoff when it drops.
+        If logstream isn't available, new bytes are polled for every interval
+        seconds with Range requests instead.
+        """
+        regex = re.compile(pattern) if pattern else None
+        delay = 1
+        while True:
+            try:
+                with self.session.get(
+                    f"{self.url}logstream/{path}", stream=True, timeout=(10, 300)
+                ) as response:
+                    if response.status_code in (404, 405):
+                        logging.info("logstream unavailable, polling instead...")
+                        break
+                    if response.ok is False:
+                        raise AssertionError(
+                            f"Failed to stream logs from {self.url}logstream/{path}: "
+                            + f"{response.status_code}"
+                        )
+                    for line in response.iter_lines(decode_unicode=True):
+                        delay = 1
+                        if line and (regex is None or regex.search(line)):
+                            yield line
+            except (OSError, AssertionError) as error:
+                logging.warning(f"Log stream dropped, reconnecting in {delay}s...")
+                logging.debug(error)
+            sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, 60)
 
-    def deploy_zip(self, path):
+        yield from self.poll_logs(f"LogFiles/{path}".rstrip("/"), regex, interval)
+
+    def poll_logs(self, directory, regex=None, interval=5):
+        """
+        Yield lines appended to the log files under directory, fetching only
+        the bytes written since the last poll. Failed polls are logged and
+        retried, backing off while the listing keeps failing.
+        """
+        offsets = {}
+        partial = {}
+        first = True
+        delay = interval
+        while True:
+            try:
+                logfiles = self.check_directory_for_logs(directory)
+            except (OSError, AssertionError) as error:
+                logging.warning(f"Failed to poll {directory}, retrying in {delay}s...")
+                logging.debug(error)
+                sleep(delay * random.uniform(0.5, 1.5))
+                delay = min(delay * 2, 60)
+                continue
+            delay = interval
+
+            for logfile in logfiles:
+                path = self.convert_kudu_path(logfile["path"])
+                size = logfile.get("size") or 0
+                offset = offsets.get(path, size if first else 0)
+                if size < offset:
+                    # The file was truncated or rotated, start again from the top.
+                    offset, partial[path] = 0, b""
+                if size <= offset:
+                    offsets[path] = size
+                    continue
+
+                headers = {"Range": f"bytes={offset}-{size - 1}"}
+                try:
+                    response = self.session.get(
+                        f"{self.url}vfs/{path}", headers=headers
+                    )
+                    if response.ok is False:
+                        raise AssertionError(
+                            f"Failed to read {path}: {response.status_code}"
+                        )
+                except (OSError, AssertionError) as error:
+                    # Try again from the same offset on the next poll.
+                    logging.warning(error)
+                    offsets[path] = offset
+                    continue
+                offsets[path] = size
+                data = response.content
+                if response.status_code != 206:
+                    data = data[offset:size]
+                lines = (partial.get(path, b"") + data).split(b"\n")
+                partial[path] = lines.pop()
+                for line in lines:
+                    line = line.decode("utf-8", "replace").rstrip("\r")
+                    if regex is None or regex.search(line):
+                        yield line
+            first = False
+            sleep(interval)
+
+    def deploy_zip(self, path, chunk_size=CHUNK_SIZE, checksum=None):
         """
         https://github.com/projectkudu/kudu/wiki/REST-API#zip-deployment
 
         Deploy from zip asynchronously. The Location header of the response
         will contain a link to a pollable deployment status.
+
+        The archive is streamed from disk in chunk_size pieces rather than read
+        into memory. Pass a hashlib algorithm name as checksum to have its
+        digest computed during the upload and added to the result.
         """
         try:
-            with open(path, "rb") as f:
-                zipfile = f.read()
-
-            response = requests.put(self.url + "zipdeploy?isAsync=true", data=zipfile)
+            with ProgressFile(path, chunk_size, checksum) as zipfile:
+                response = self.session.put(
+                    self.url + "zipdeploy?isAsync=true", data=zipfile
+                )
+                zipfile.progress.finish()
+                digest = zipfile.hexdigest()
+                if digest:
+                    logging.info(f"{checksum} of {path}: {digest}")
 
             if response.ok:
-                timeout = time() + 60
-                while time() < timeout:
-                    logging.debug(f"Checking deployment {response.headers['Location']}")
-                    status = requests.get(
-                        response.headers["Location"], headers=self.headers
-                    )
-                    logging.debug(f"Deployment Complete: {status.json()['complete']}")
-                    if status.json()["complete"]:
-                        return status.json()
+                location = response.headers["Location"]
+
+                def check():
+                    logging.debug(f"Checking deployment {location}")
+                    status = self.session.get(location, headers=self.headers)
+                    complete = status.json()["complete"]
+                    logging.debug(f"Deployment Complete: {complete}")
+                    return complete, status.json(), status
+
+                done, status = Poller(deadline=60, delay=2).wait(check)
+                if done:
+                    if digest:
+                        status["checksum"] = {checksum: digest}
+                    return status
 
             raise AssertionError(
                 f"Deploying {path} on {self.url}zipdeploy\n"
@@ -94,20 +304,20 @@ class KuduClient(AppService):
             logging.debug(traceback.format_exc())
             raise error
 
-    def download_zip(self, source, destination):
+    def download_zip(self, source, destination, chunk_size=CHUNK_SIZE):
         """
         https://github.com/projectkudu/kudu/wiki/REST-API#zip
 
         Zip up and download the specified folder. The zip doesn't include the
         top folder itself. Make sure you include the trailing slash!
+
+        The archive is streamed straight to disk, so memory use doesn't grow
+        with its size, and interrupted downloads are resumed where possible.
         """
         try:
-            response = requests.get(f"{self.url}zip/{source}")
-            logging.debug(response.headers)
-            zipbytes = response.content
-            zipfile = open(destination, "wb")
-            zipfile.write(zipbytes)
-            zipfile.close()
+            response = download(
+                self.session, f"{self.url}zip/{source}", destination, chunk_size
+            )
         except Exception as error:
             logging.debug(
                 f"Failed to download zip from {self.url}zip/{source}: {error}"
@@ -117,12 +327,156 @@ class KuduClient(AppService):
 
         return response
 
+    def read_manifest(self, remote):
+        response = self.session.get(f"{self.url}vfs/{MANIFEST_DIR}/{remote}.json")
+        if response.ok is False:
+            return {}
+        try:
+            return response.json()
+        except ValueError:
+            return {}
+
+    def put_file(self, local_path, remote_path):
+        """
+        https://github.com/projectkudu/kudu/wiki/REST-API#vfs
+        """
+        with open(local_path, "rb") as f:
+            response = self.session.put(
+                f"{self.url}vfs/{remote_path}", data=f, headers={"If-Match": "*"}
+            )
+        if response.ok is False:
+            raise AssertionError(
+                f"Failed to upload {local_path} to {remote_path}: "
+                + f"{response.status_code}"
+            )
+        return remote_path
+
+    def delete_file(self, remote_path):
+        response = self.session.delete(
+            f"{self.url}vfs/{remote_path}", headers={"If-Match": "*"}
+        )
+        if response.ok is False and response.status_code != 404:
+            raise AssertionError(
+                f"Failed to delete {remote_path}: {response.status_code}"
+            )
+        return remote_path
+
+    def list_files(self, remote, workers=8):
+        """
+        Return a dict of path relative to remote to VFS entry for every file
+        under remote.
+        """
+        files = {}
+        for entry in self.crawl(remote, workers=workers):
+            path = self.convert_kudu_path(entry["path"])
+            files[path[len(remote) + 1 :]] = entry
+        return files
+
+    def sync_directory(self, local, remote="site/wwwroot", delete=False, workers=8):
+        """
+        Upload only the files under local that differ from remote, and
+        optionally delete remote files that no longer exist locally.
+
+        Files are compared by sha256 against a manifest kept in MANIFEST_DIR,
+        as long as their remote size and mtime still match the ones it
+        recorded, and by size and modification time otherwise. Returns a
+        dict of uploaded, deleted and unchanged relative paths.
+        """
+        remote = remote.strip("/")
+        remote_files = self.list_files(remote, workers)
+        manifest = self.read_manifest(remote)
+
+        local_files = {}
+        for root, dirs, files in os.walk(local):
+            for name in files:
+                path = os.path.join(root, name)
+                relpath = os.path.relpath(path, local).replace(os.sep, "/")
+                local_files[relpath] = {
+                    "path": path,
+                    "size": os.path.getsize(path),
+                    "sha256": sha256sum(path),
+                }
+
+        changed, unchanged = [], []
+        for relpath, local_file in local_files.items():
+            entry = remote_files.get(relpath)
+            recorded = manifest.get(relpath)
+            if recorded and entry:
+                # Changed remotely since the manifest was written, if these differ.
+                same = recorded["sha256"] == local_file["sha256"] and (
+                    recorded.get("size") == entry.get("size")
+                    and recorded.get("mtime") == entry["mtime"]
+                )
+            elif entry:
+                mtime = os.path.getmtime(local_file["path"])
+                same = entry.get("size") == local_file["size"] and (
+                    mtime <= parse_kudu_time(entry["mtime"]).timestamp()
+                )
+            else:
+                same = False
+            (unchanged if same else changed).append(relpath)
+
+        deleted = [path for path in remote_files if path not in local_files]
+        logging.info(
+            f"{len(changed)} changed, {len(unchanged)} unchanged"
+            + (f", {len(deleted)} to delete" if delete else "")
+        )
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(
+                executor.map(
+                    lambda relpath: self.put_file(
+                        local_files[relpath]["path"], f"{remote}/{relpath}"
+                    ),
+                    changed,
+                )
+            )
+            if delete:
+                list(
+                    executor.map(
+                        lambda relpath: self.delete_file(f"{remote}/{relpath}"),
+                        deleted,
+                    )
+                )
+
+        if changed or (delete and deleted) or not manifest:
+            if changed:
+                # Pick up the size and mtime the uploads ended up with.
+                remote_files = self.list_files(remote, workers)
+            self.write_manifest(remote, local_files, remote_files)
+
+        return {
+            "uploaded": changed,
+            "deleted": deleted if delete else [],
+            "unchanged": unchanged,
+        }
+
+    def write_manifest(self, remote, local_files, remote_files):
+        manifest = {
+            relpath: {
+                "sha256": local_file["sha256"],
+                "size": remote_files[relpath].get("size"),
+                "mtime": remote_files[relpath]["mtime"],
+            }
+            for relpath, local_file in local_files.items()
+            if relpath in remote_files
+        }
+        response = self.session.put(
+            f"{self.url}vfs/{MANIFEST_DIR}/{remote}.json",
+            data=json.dumps(manifest),
+            headers={"If-Match": "*"},
+        )
+        if response.ok is False:
+            logging.warning(
+                f"Failed to write the manifest for {remote}: {response.status_code}"
+            )
+
     def get_endpoint(self, endpoint):
         """
         https://github.com/projectkudu/kudu/wiki/REST-API
         """
         try:
-            response = requests.get(self.url + endpoint)
+            response = self.session.get(self.url + endpoint)
             if response.ok is False:
                 raise AssertionError(
                     f"Failed to get {endpoint} on {self.url}\n"
@@ -139,15 +493,24 @@ class KuduClient(AppService):
         )
         return response.json()
 
-    def run_cmd(self, cmd, cwd):
+    def run_cmd(self, cmd, cwd, instance=None, timeout=None):
         """
         https://github.com/projectkudu/kudu/wiki/REST-API#command
+
+        Pass an instance id to pin the command to that instance through the
+        ARRAffinity cookie, rather than whichever one the load balancer picks.
+        It is sent as an explicit Cookie header, which requests sends instead
+        of the session's cookie jar, as the jar may already hold the
+        ARRAffinity cookie of another instance.
         """
         logging.debug(f"Running {cmd} on {self.app}/{cwd}...")
         payload = {"command": cmd, "dir": cwd}
+        headers = {"Cookie": f"ARRAffinity={instance}"} if instance else None
 
         try:
-            response = requests.post(self.url + "command", json=payload)
+            response = self.session.post(
+                self.url + "command", json=payload, headers=headers, timeout=timeout
+            )
             if response.ok is False:
                 raise AssertionError(
                     f"Failed to run {cmd} on {self.url}/{cwd}\n"
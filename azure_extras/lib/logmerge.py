@@ -0,0 +1,74 @@
+import heapq
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+TIMESTAMP = re.compile(r"(\d{4}-\d{2}-\d{2})[T ](\d{2}:\d{2}:\d{2})(?:[.,](\d+))?")
+
+
+def parse_timestamp(line):
+    """
+    Return the first ISO 8601 style timestamp in line as a naive datetime, or
+    None if there isn't one.
+    """
+    match = TIMESTAMP.search(line)
+    if match is None:
+        return None
+
+    date, time, fraction = match.groups()
+    fraction = (fraction or "0")[:6].ljust(6, "0")
+    try:
+        return datetime.strptime(f"{date} {time}.{fraction}", "%Y-%m-%d %H:%M:%S.%f")
+    except ValueError:
+        return None
+
+
+def timestamped(app, lines):
+    """
+    Yield (timestamp, app, line) tuples. Lines without a timestamp, such as
+    stack trace continuations, inherit the one from the line before them.
+    """
+    last = datetime.min
+    for line in lines:
+        last = parse_timestamp(line) or last
+        yield last, app, line
+
+
+def merge_logs(streams):
+    """
+    Merge a dict of app to lines into one time ordered stream of (timestamp,
+    app, line) tuples.
+
+    An app's lines come from several log files and aren't necessarily in
+    order, which heapq.merge relies on, so each app's lines are stable sorted
+    by timestamp first, keeping continuation lines after the line they
+    belong to.
+    """
+    return heapq.merge(
+        *(
+            sorted(timestamped(app, lines), key=lambda entry: entry[0])
+            for app, lines in streams.items()
+        ),
+        key=lambda entry: entry[0],
+    )
+
+
+def tail_fleet(clients, line_count, workers=8):
+    """
+    Tail the logs of a dict of app to KuduClient concurrently and yield their
+    merged (timestamp, app, line) tuples once they have all been fetched.
+    """
+
+    def lines(app, future):
+        try:
+            yield from future.result()
+        except Exception as error:
+            logging.error(f"Failed to get logs for {app}: {error}")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        streams = {
+            app: lines(app, executor.submit(client.tail_logs, line_count))
+            for app, client in clients.items()
+        }
+        yield from merge_logs(streams)
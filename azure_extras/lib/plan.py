@@ -0,0 +1,214 @@
+import logging
+from configparser import ConfigParser
+from .app import AppService
+from .saj import StreamAnalyticsJobs
+from .scheduler import Scheduler
+
+# Rough seconds each kind of step takes, used to find the critical path.
+DURATIONS = {"app": 30, "slot": 30, "job": 120, "healthcheck": 5}
+
+
+class Step:
+    def __init__(self, key, kind, name, action, app=None, after=(), estimate=None):
+        if not kind:
+            raise ValueError(f"{key} has no type")
+        if kind not in DURATIONS:
+            raise ValueError(f"{key} has unknown type {kind}")
+        if kind == "slot" and not app:
+            raise ValueError(f"Slot step {key} needs an app")
+        if not action:
+            raise ValueError(f"{key} has no action")
+        self.key = key
+        self.kind = kind
+        self.name = name
+        self.action = action
+        self.app = app
+        self.after = list(after)
+        self.estimate = float(estimate) if estimate else DURATIONS[kind]
+
+    def __str__(self):
+        target = f"{self.app}/{self.name}" if self.kind == "slot" else self.name
+        return f"{self.action} {self.kind} {target}"
+
+
+def load_plan(path):
+    """
+    Read a plan from YAML (needs PyYAML) or INI and return a tuple of
+    (resource_group, dict of key to Step).
+
+    YAML plans have resource_group and action keys and a steps mapping of
+    key to type, name, app, action, after (a key or list of keys) and
+    estimate. INI plans put resource_group and action in a [plan] section
+    and have one section per step, with after as a comma separated list.
+    """
+    if path.endswith((".yml", ".yaml")):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("Install PyYAML to read YAML plans.")
+        with open(path) as f:
+            plan = yaml.safe_load(f)
+        rg = plan["resource_group"]
+        default_action = plan.get("action")
+        raw = plan.get("steps") or {}
+    else:
+        config = ConfigParser()
+        config.read(path)
+        rg = config["plan"]["resource_group"]
+        default_action = config["plan"].get("action")
+        raw = {}
+        for key in config.sections():
+            if key == "plan":
+                continue
+            section = dict(config[key])
+            after = section.get("after", "")
+            section["after"] = [dep.strip() for dep in after.split(",") if dep.strip()]
+            raw[key] = section
+
+    steps = {}
+    for key, step in raw.items():
+        after = step.get("after") or []
+        if isinstance(after, str):
+            after = [after]
+        steps[key] = Step(
+            key,
+            step.get("type"),
+            step.get("name", key),
+            step.get("action", default_action),
+            step.get("app"),
+            after,
+            step.get("estimate"),
+        )
+    validate(steps)
+    return rg, steps
+
+
+def validate(steps):
+    if not steps:
+        raise ValueError("The plan has no steps")
+    for step in steps.values():
+        for dep in step.after:
+            if dep not in steps:
+                raise ValueError(f"{step.key} depends on unknown step {dep}")
+
+    visiting, visited = set(), set()
+
+    def visit(key):
+        if key in visited:
+            return
+        if key in visiting:
+            raise ValueError(f"Dependency cycle through {key}")
+        visiting.add(key)
+        for dep in steps[key].after:
+            visit(dep)
+        visiting.discard(key)
+        visited.add(key)
+
+    for key in steps:
+        visit(key)
+
+
+def critical_paths(steps):
+    """
+    Return a dict of step key to the estimated time from that step starting
+    until everything that depends on it has finished.
+    """
+    dependents = {key: [] for key in steps}
+    for step in steps.values():
+        for dep in step.after:
+            dependents[dep].append(step.key)
+
+    lengths = {}
+
+    def length(key):
+        if key not in lengths:
+            tail = max((length(dep) for dep in dependents[key]), default=0)
+            lengths[key] = steps[key].estimate + tail
+        return lengths[key]
+
+    for key in steps:
+        length(key)
+    return lengths
+
+
+def simulate(steps, workers):
+    """
+    Return the expected schedule as a list of (start, end, step) tuples by
+    replaying critical path first list scheduling on the estimates.
+    """
+    priority = critical_paths(steps)
+    finished = {}
+    running = []
+    pending = set(steps)
+    schedule = []
+    now = 0.0
+
+    while pending or running:
+        done = {key for key, end in finished.items() if end <= now}
+        ready = [key for key in pending if set(steps[key].after) <= done]
+        ready.sort(key=lambda key: priority[key], reverse=True)
+        for key in ready[: workers - len(running)]:
+            end = now + steps[key].estimate
+            running.append((end, key))
+            pending.discard(key)
+            schedule.append((now, end, steps[key]))
+        running.sort()
+        end, key = running.pop(0)
+        finished[key] = end
+        now = max(now, end)
+
+    return sorted(schedule, key=lambda entry: (entry[0], entry[2].key))
+
+
+class PlanRunner:
+    """
+    Run a plan's steps with as much parallelism as its dependencies allow,
+    starting the steps on the critical path first. Every step shares one
+    authenticated ARM context and connection pool.
+    """
+
+    def __init__(self, config, rg, steps, workers=20):
+        self.steps = steps
+        self.workers = workers
+        kinds = {step.kind for step in steps.values()}
+        self.app_service = None
+        self.saj = None
+        if kinds & {"app", "slot", "healthcheck"}:
+            self.app_service = AppService(config, rg, pool_size=workers)
+        if "job" in kinds:
+            self.saj = StreamAnalyticsJobs(config, rg, pool_size=workers)
+
+    def run_step(self, step):
+        if step.kind == "job":
+            results = self.saj.toggle_stream_analytics_job(step.name, step.action)
+            return results["properties"]["jobState"]
+        if step.kind == "healthcheck":
+            self.app_service.toggle_health_check(step.name, step.action)
+            return step.action.upper() + "D"
+        if step.kind == "slot":
+            status = self.app_service.toggle_app_service_slot(
+                step.app, step.name, step.action
+            )
+        else:
+            status = self.app_service.toggle_app_service(step.name, step.action)
+        if status is None:
+            # Failures are logged and swallowed by the toggles, but dependent
+            # steps must not run.
+            raise AssertionError(f"Failed to {step}")
+        return status
+
+    def run(self):
+        """
+        Yield a (step, result, error) tuple for every step as it finishes.
+        """
+        priority = critical_paths(self.steps)
+        scheduler = Scheduler(self.workers)
+        for key, step in self.steps.items():
+            scheduler.add(
+                key, self.run_step, step, after=step.after, priority=priority[key]
+            )
+
+        for key, result, error in scheduler.run():
+            if error:
+                logging.debug(f"{key}: {error}")
+            yield self.steps[key], result, error
@@ -0,0 +1,195 @@
+import logging
+import random
+from email.utils import parsedate_to_datetime
+from time import sleep, time
+
+TERMINAL_STATES = ("Succeeded", "Failed", "Canceled")
+FAILED_STATES = ("Failed", "Canceled")
+
+
+def get_retry_after(response):
+    """
+    Seconds to wait according to a response's Retry-After header, if any.
+    """
+    if response is None:
+        return None
+
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Poller:
+    """
+    Poll a long running operation with exponential backoff and jitter.
+
+    Each call to check() returns a (done, value, response) tuple. A
+    Retry-After header on the response overrides the next backoff delay.
+
+    Every wait on the same Poller shares one deadline, counted from the
+    first, so following an operation and then polling the resource's state
+    can't take longer than deadline between them. polls and elapsed add up
+    how many checks were made and how long it all took.
+    """
+
+    def __init__(self, deadline=30, delay=1, max_delay=15, factor=2, jitter=0.2):
+        self.deadline = deadline
+        self.delay = delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.polls = 0
+        self.elapsed = 0.0
+        self.start = None
+
+    def begin(self):
+        """
+        Start the clock unless an earlier wait already has, and return when
+        the deadline passes.
+        """
+        if self.start is None:
+            self.start = time()
+        return self.start + self.deadline
+
+    def next_delay(self, attempt, response, end):
+        delay = get_retry_after(response)
+        if delay is None:
+            delay = min(self.max_delay, self.delay * self.factor**attempt)
+            delay = delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(0.0, min(delay, end - time()))
+
+    def log_stats(self, done):
+        logging.debug(
+            f"{'Finished' if done else 'Gave up'} polling after "
+            + f"{self.polls} requests in {self.elapsed:.1f}s"
+        )
+
+    def wait(self, check):
+        """
+        Call check() until it reports done or the deadline passes and return a
+        (done, value) tuple with the last value seen.
+        """
+        end = self.begin()
+        attempt = 0
+        while True:
+            self.polls += 1
+            done, value, response = check()
+            self.elapsed = time() - self.start
+            if done or time() >= end:
+                self.log_stats(done)
+                return done, value
+            sleep(self.next_delay(attempt, response, end))
+            attempt += 1
+
+    async def wait_async(self, check):
+        """
+        Coroutine version of wait() where check is a coroutine function.
+        """
+        # Imported here so the sync clients don't pay for asyncio.
+        import asyncio
+
+        end = self.begin()
+        attempt = 0
+        while True:
+            self.polls += 1
+            done, value, response = await check()
+            self.elapsed = time() - self.start
+            if done or time() >= end:
+                self.log_stats(done)
+                return done, value
+            await asyncio.sleep(self.next_delay(attempt, response, end))
+            attempt += 1
+
+    def wait_for_operation(self, session, response, headers=None):
+        """
+        https://docs.microsoft.com/en-us/azure/azure-resource-manager/management/async-operations
+
+        Follow the Azure-AsyncOperation (or, for a 202, the Location) header of
+        an ARM response until the operation finishes. Returns a (done, body)
+        tuple, or (True, None) when the operation completed synchronously, and
+        raises AssertionError as soon as the operation fails or is canceled.
+        """
+        url, operation = operation_url(response.status_code, response.headers)
+        if url is None:
+            return True, None
+
+        def check():
+            status = session.get(url, headers=headers)
+            if operation is False and status.status_code >= 400:
+                raise AssertionError(f"Operation {url} failed: {status.status_code}")
+            body = status.json() if status.content else {}
+            return operation_done(operation, status.status_code, body), body, status
+
+        end = self.begin()
+        sleep(max(0.0, min(get_retry_after(response) or 0, end - time())))
+        done, body = self.wait(check)
+        check_operation(body)
+        return done, body
+
+    async def wait_for_operation_async(self, fetch, response, headers=None):
+        """
+        Coroutine version of wait_for_operation(), where fetch is a coroutine
+        function like AsyncAzureExtras.fetch returning a (response, body)
+        tuple for a request.
+        """
+        # Imported here so the sync clients don't pay for asyncio.
+        import asyncio
+
+        url, operation = operation_url(response.status, response.headers)
+        if url is None:
+            return True, None
+
+        async def check():
+            status, body = await fetch("GET", url, headers=headers)
+            if operation is False and status.status >= 400:
+                raise AssertionError(f"Operation {url} failed: {status.status}")
+            return operation_done(operation, status.status, body), body, status
+
+        end = self.begin()
+        await asyncio.sleep(max(0.0, min(get_retry_after(response) or 0, end - time())))
+        done, body = await self.wait_async(check)
+        check_operation(body)
+        return done, body
+
+
+def operation_url(status, headers):
+    """
+    Return the url to poll for an ARM response and whether it is an
+    Azure-AsyncOperation, or (None, None) when there is nothing to follow.
+    """
+    if headers.get("Azure-AsyncOperation"):
+        url, operation = headers["Azure-AsyncOperation"], True
+    elif status == 202 and headers.get("Location"):
+        url, operation = headers["Location"], False
+    else:
+        return None, None
+    logging.debug(f"Polling long running operation {url}")
+    return url, operation
+
+
+def operation_done(operation, status, body):
+    if operation:
+        return body.get("status") in TERMINAL_STATES
+    return status != 202
+
+
+def check_operation(body):
+    """
+    Raise AssertionError if an Azure-AsyncOperation body says it failed.
+    """
+    if body and body.get("status") in FAILED_STATES:
+        error = body.get("error") or {}
+        raise AssertionError(
+            f"Operation {body['status'].lower()}: "
+            + (error.get("message") or error.get("code") or "no details")
+        )
@@ -0,0 +1,127 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from .app import HEALTH_CHECK_PATHS
+
+# States that already satisfy each action, including transitions in progress.
+APP_STATES = {"start": ("Running",), "stop": ("Stopped",)}
+JOB_STATES = {
+    "start": ("Running", "Starting", "Idle", "Processing", "Degraded"),
+    "stop": ("Stopped", "Stopping", "Created"),
+}
+
+
+def make_report():
+    """
+    changed maps names to their new state, skipped maps names to the state
+    that already matched, and failed lists names we couldn't read or change.
+    """
+    return {"changed": {}, "skipped": {}, "failed": []}
+
+
+def diff(current, wanted, report):
+    """
+    Return the names whose current state isn't one of wanted, recording the
+    rest as skipped and unreadable ones as failed.
+    """
+    differs = []
+    for name, state in current.items():
+        if state is None:
+            report["failed"].append(name)
+        elif state in wanted:
+            report["skipped"][name] = state
+        else:
+            differs.append(name)
+    return differs
+
+
+def apply(results, wanted, report):
+    """
+    Record the names whose toggle ended in one of wanted as changed, and the
+    rest, which failed or gave up waiting, as failed.
+    """
+    for name, state in results.items():
+        if state in wanted:
+            report["changed"][name] = state
+        else:
+            report["failed"].append(name)
+
+
+def reconcile_app_services(app_service, names, action):
+    """
+    Bring App Services, or slots named "app/slots/slot", to the state action
+    leads to, only sending start/stop to those not already there.
+    """
+    report = make_report()
+    current = {
+        name: properties["state"] if properties else None
+        for name, properties in app_service.get_many(names).items()
+    }
+    differs = diff(current, APP_STATES[action], report)
+    logging.info(f"{len(differs)} of {len(names)} need to {action}")
+    if differs:
+        apply(app_service.toggle_many(differs, action), APP_STATES[action], report)
+    return report
+
+
+def reconcile_health_checks(app_service, apps, action, workers=8):
+    """
+    Only patch the health check path of apps where it doesn't already match.
+    """
+    if action not in HEALTH_CHECK_PATHS:
+        raise ValueError(f"{action} is invalid!")
+
+    report = make_report()
+    wanted = [HEALTH_CHECK_PATHS[action]]
+    if action == "disable":
+        # An unset path is as good as the "null" one disable writes.
+        wanted.append("")
+    current = {
+        app: str(config.get("healthCheckPath") or "") if config else None
+        for app, config in app_service.get_web_config_many(apps).items()
+    }
+    differs = diff(current, wanted, report)
+    logging.info(f"{len(differs)} of {len(apps)} need their health check {action}d")
+
+    def toggle(app):
+        try:
+            app_service.toggle_health_check(app, action)
+            return HEALTH_CHECK_PATHS[action]
+        except Exception as error:
+            logging.error(error)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = dict(zip(differs, executor.map(toggle, differs)))
+    apply(results, wanted, report)
+    return report
+
+
+def reconcile_stream_analytics_jobs(saj, jobs, action):
+    """
+    Only send start/stop to Stream Analytics jobs not already in, or heading
+    to, the state action leads to.
+    """
+    report = make_report()
+    current = {
+        job: body["properties"]["jobState"] if body else None
+        for job, body in saj.get_many(jobs).items()
+    }
+    differs = diff(current, JOB_STATES[action], report)
+    logging.info(f"{len(differs)} of {len(jobs)} need to {action}")
+    if differs:
+        # toggle_many waits for exactly Running or Stopped, anything else it
+        # returns is where it gave up.
+        apply(saj.toggle_many(differs, action), APP_STATES[action], report)
+    return report
+
+
+def print_report(report, action):
+    for name, state in sorted(report["changed"].items()):
+        print(f"Sending {action} to {name}.. {str(state).upper()}.")
+    for name, state in sorted(report["skipped"].items()):
+        print(f"Skipping {name}.. already {str(state).upper() or 'UNSET'}.")
+    for name in sorted(report["failed"]):
+        print(f"Sending {action} to {name}.. FAILED.")
+    print(
+        f"{len(report['changed'])} changed, {len(report['skipped'])} skipped, "
+        f"{len(report['failed'])} failed."
+    )
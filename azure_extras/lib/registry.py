@@ -0,0 +1,112 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import time
+from .app import AppService
+from .kudu import KuduClient
+from .utils import CACHE_DIR, read_cache, write_cache
+
+CACHE_PATH = os.path.join(CACHE_DIR, "scm.json")
+
+
+class KuduRegistry:
+    """
+    Hands out KuduClient instances that share one authenticated ARM context
+    and connection pool.
+
+    scm URIs are resolved from publishing credentials concurrently and cached
+    on disk for ttl seconds, so building clients for many apps costs at most
+    one ARM round trip per app per ttl.
+    """
+
+    def __init__(self, path, rg, pool_size=10, ttl=3600, workers=8):
+        self.config_path = path
+        self.rg = rg
+        self.pool_size = pool_size
+        self.ttl = ttl
+        self.workers = workers
+        self.cache_path = CACHE_PATH
+        self.app_service = AppService(path, rg, pool_size)
+        self.clients = {}
+        self.lock = Lock()
+
+    def cache_key(self, app):
+        return f"{self.app_service.url}/{app}"
+
+    def resolve(self, apps, errors=None):
+        """
+        Return a dict of app to scm URI, only asking ARM for the ones that
+        aren't cached or have expired. If errors is a dict, apps that can't
+        be resolved are added to it with their exception and left out,
+        rather than the first failure being raised.
+        """
+        cache = read_cache(self.cache_path)
+        uris = {}
+        missing = []
+        for app in apps:
+            entry = cache.get(self.cache_key(app))
+            if entry and time() - entry["resolved"] < self.ttl:
+                uris[app] = entry["scmUri"]
+            else:
+                missing.append(app)
+
+        if missing:
+            logging.info(f"Resolving scm URIs for {', '.join(missing)}")
+            workers = min(self.workers, len(missing))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    app: executor.submit(
+                        self.app_service.get_publishing_credentials, app
+                    )
+                    for app in missing
+                }
+                for app, future in futures.items():
+                    try:
+                        uris[app] = future.result()["scmUri"]
+                    except Exception as error:
+                        if errors is None:
+                            raise
+                        errors[app] = error
+
+            cache = {
+                key: entry
+                for key, entry in read_cache(self.cache_path).items()
+                if time() - entry["resolved"] < self.ttl
+            }
+            for app in missing:
+                if app in uris:
+                    cache[self.cache_key(app)] = {
+                        "scmUri": uris[app],
+                        "resolved": time(),
+                    }
+            write_cache(self.cache_path, cache)
+
+        return uris
+
+    def get_many(self, apps, errors=None):
+        """
+        Return a dict of app to KuduClient, leaving out any apps that fail to
+        resolve when errors is a dict to collect them in (see resolve).
+        """
+        with self.lock:
+            wanted = [app for app in apps if app not in self.clients]
+            for app, uri in self.resolve(wanted, errors).items():
+                self.clients[app] = KuduClient(
+                    self.config_path, self.rg, app, self.pool_size, scm_uri=uri
+                )
+            return {app: self.clients[app] for app in apps if app in self.clients}
+
+    def get(self, app):
+        return self.get_many([app])[app]
+
+    def invalidate(self, app):
+        """
+        Forget a cached scm URI, e.g. after its publishing credentials were
+        reset.
+        """
+        with self.lock:
+            self.clients.pop(app, None)
+            cache = read_cache(self.cache_path)
+            cache.pop(self.cache_key(app), None)
+            write_cache(self.cache_path, cache)
@@ -0,0 +1,97 @@
+import json
+import os
+import socket
+import sys
+
+# Kept free of heavy imports, since this runs before every CLI invocation.
+SOCKET_PATH = os.environ.get(
+    "AZURE_EXTRAS_SOCKET",
+    os.path.join(os.path.expanduser("~"), ".azure_extras", "daemon.sock"),
+)
+
+# Commands the daemon can run, and the modules whose main() implements them.
+COMMANDS = {
+    "asctl": "azure_extras.asctl",
+    "healthchkctl": "azure_extras.healthchkctl",
+    "kuductl": "azure_extras.kuductl",
+    "planctl": "azure_extras.planctl",
+    "sajctl": "azure_extras.sajctl",
+}
+
+# The parsed argument that, when given, makes a command run until it is
+# interrupted. That would tie up the daemon, so the daemon hands those back to
+# run in-process, after parsing them with the command's own get_parser().
+LONG_RUNNING = {"kuductl": "follow"}
+
+
+def connect(path=SOCKET_PATH, timeout=1):
+    """
+    Return a socket connected to the daemon, or None if it isn't running.
+    """
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    sock.settimeout(None)
+    return sock
+
+
+def send(sock, message):
+    sock.sendall(json.dumps(message).encode() + b"\n")
+
+
+def receive(sock):
+    """
+    Yield the json messages the daemon sends back, one per line.
+    """
+    with sock.makefile("rb") as lines:
+        for line in lines:
+            yield json.loads(line)
+
+
+def call(command, argv=(), path=SOCKET_PATH):
+    """
+    Run command with argv in the daemon, copying its output to ours as it
+    arrives. Returns the exit code, or None if the daemon isn't running or
+    handed the command back to run in-process.
+
+    Interrupting the call (e.g. with Ctrl-C) hangs up on the daemon, which
+    cancels the command there.
+    """
+    sock = connect(path)
+    if sock is None:
+        return None
+
+    with sock:
+        send(sock, {"command": command, "argv": list(argv), "cwd": os.getcwd()})
+        try:
+            for message in receive(sock):
+                if "stdout" in message:
+                    sys.stdout.write(message["stdout"])
+                    sys.stdout.flush()
+                elif "stderr" in message:
+                    sys.stderr.write(message["stderr"])
+                    sys.stderr.flush()
+                elif "local" in message:
+                    return None
+                elif "exit" in message:
+                    return message["exit"]
+        except KeyboardInterrupt:
+            return 130
+    # The daemon went away mid command.
+    return 1
+
+
+def forward(command, argv):
+    """
+    Return the exit code of running command in the daemon, or None if it
+    should run in-process instead.
+    """
+    if os.environ.get("AZURE_EXTRAS_DAEMON", "1") == "0":
+        return None
+    return call(command, argv)
@@ -1,31 +1,37 @@
 import json
 import logging
-import requests
 import traceback
 from .az import AzureExtras
-from time import time, sleep
+from .poll import Poller
 
 
 class StreamAnalyticsJobs(AzureExtras):
-    def __init__(self, path, rg):
-        super().__init__(path, rg)
+    def __init__(self, path, rg, pool_size=10):
+        super().__init__(path, rg, pool_size)
         self.url = f"{self.url}/providers/Microsoft.StreamAnalytics/streamingjobs"
 
-    def get_stream_analytics_job(self, job):
+    def get_stream_analytics_job(self, job, expand=True, max_age=0):
+        """
+        Get a Stream Analytics job, with its inputs, transformation, outputs
+        and functions unless expand is False, which is all status checks
+        need. Served from the shared state cache when it is younger than
+        max_age seconds (never by default), and revalidated with its ETag
+        otherwise.
+        """
         url = f"{self.url}/{job}"
-        params = {
-            "api-version": "2015-10-01",
-            "$expand": "inputs,transformation,outputs,functions",
-        }
+        params = {"api-version": "2015-10-01"}
+        if expand:
+            params["$expand"] = "inputs,transformation,outputs,functions"
         try:
-            response = requests.get(url, headers=self.headers, params=params)
-            body = json.loads(response.content if response.content else "{}")
+            status, reason, body = self.cache.get(
+                self.session, url, self.headers, params, max_age
+            )
             logging.debug(json.dumps(body))
-            if response.ok is False:
+            if status >= 400:
                 raise AssertionError(
                     f"Failed to get {job} status from {url}\n"
-                    + f"Response Code: {response.status_code}\n"
-                    + f"Response Reason: {response.reason}"
+                    + f"Response Code: {status}\n"
+                    + f"Response Reason: {reason}"
                 )
         except Exception as error:
             logging.debug(traceback.format_exc())
@@ -38,7 +44,7 @@ class StreamAnalyticsJobs(AzureExtras):
         params = {"api-version": "2015-10-01"}
 
         try:
-            response = requests.post(url, headers=self.headers, params=params)
+            response = self.session.post(url, headers=self.headers, params=params)
             if response.ok is False:
                 raise AssertionError(
                     f"Failed to {action} {job} using {url}\n"
@@ -47,19 +53,26 @@ class StreamAnalyticsJobs(AzureExtras):
                 )
 
             logging.info(f"Sent {action} to {job}")
-            timeout = time() + 120
-            while time() < timeout:
+            self.cache.invalidate(f"{self.url}/{job}")
+            # Raises straight away if the operation fails, and shares its
+            # deadline with the state checks below.
+            poller = Poller(deadline=120, delay=2, max_delay=20)
+            poller.wait_for_operation(self.session, response, self.headers)
+
+            def check():
                 logging.info(f"Checking status of {action} sent to {job}..")
-                results = self.get_stream_analytics_job(job)
+                results = self.get_stream_analytics_job(job, expand=False, max_age=0)
                 status = results["properties"]["jobState"]
                 logging.debug(f"RESULTS: {status}")
                 started = action == "start" and status == "Running"
                 stopped = action == "stop" and status == "Stopped"
-                if started or stopped:
-                    logging.info(f"Successfully sent {action} to {job}.")
-                    return results
-                logging.info(f"Waiting 10 seconds before checking again...")
-                sleep(10)
+                return started or stopped, results, None
+
+            done, results = poller.wait(check)
+            status = results["properties"]["jobState"]
+            if done:
+                logging.info(f"Successfully sent {action} to {job}.")
+                return results
 
             raise AssertionError(
                 f"Failed to {action} {job}. Timed out. Status: {status}"
@@ -67,3 +80,84 @@ class StreamAnalyticsJobs(AzureExtras):
         except Exception as error:
             logging.debug(traceback.format_exc())
             raise error
+
+    def get_many(self, jobs):
+        """
+        Get many Stream Analytics jobs, without expanding their inputs,
+        outputs and functions, using ARM batch requests. Returns a dict of job
+        to body, or None on failure.
+        """
+        params = {"api-version": "2015-10-01"}
+        responses = self.batch(
+            [self.batch_request("GET", f"{self.url}/{job}", params) for job in jobs]
+        )
+        results = {}
+        for job, response in zip(jobs, responses):
+            if response and response["httpStatusCode"] < 400:
+                results[job] = response["content"]
+            else:
+                logging.error(f"Failed to get {job} status")
+                results[job] = None
+        return results
+
+    def toggle_many(self, jobs, action, deadline=300):
+        """
+        START/STOP many Stream Analytics jobs with ARM batch requests, then
+        poll their state in batches. Returns a dict of job to final jobState,
+        or None for those that failed.
+        """
+        params = {"api-version": "2015-10-01"}
+        responses = self.batch(
+            [
+                self.batch_request("POST", f"{self.url}/{job}/{action}", params)
+                for job in jobs
+            ]
+        )
+        states = {}
+        pending = []
+        for job, response in zip(jobs, responses):
+            if response and response["httpStatusCode"] < 400:
+                logging.info(f"Sent {action} to {job}")
+                pending.append(job)
+            else:
+                logging.error(f"Failed to {action} {job}")
+                states[job] = None
+
+        wanted = "Running" if action == "start" else "Stopped"
+
+        def check():
+            for job, body in self.get_many(pending).items():
+                states[job] = body["properties"]["jobState"] if body else None
+                if states[job] == wanted:
+                    pending.remove(job)
+            return not pending, states, None
+
+        done, states = Poller(deadline=deadline, delay=2, max_delay=20).wait(check)
+        for job in pending:
+            logging.error(f"Failed to {action} {job}. Timed out. Status: {states[job]}")
+        return states
+
+    def start_many(self, jobs):
+        return self.toggle_many(jobs, "start")
+
+    def stop_many(self, jobs):
+        return self.toggle_many(jobs, "stop")
+
+    def select_stream_analytics_jobs(self, tag=None, regex=None, state=None):
+        """
+        Return the names of Stream Analytics jobs in the resource group with
+        tag ("name" or "name=value"), whose names match regex and, when given,
+        whose jobState is state (e.g. Running or Stopped).
+        """
+        jobs = self.select_resources(
+            "Microsoft.StreamAnalytics/streamingjobs", tag, regex
+        )
+        if state and jobs:
+            bodies = self.get_many(jobs)
+            jobs = [
+                job
+                for job in jobs
+                if bodies[job]
+                and bodies[job]["properties"]["jobState"].lower() == state.lower()
+            ]
+        return jobs
@@ -0,0 +1,105 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Task:
+    def __init__(self, key, fn, args, after, then, priority):
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.after = tuple(after)
+        self.then = then
+        self.priority = priority
+
+
+class Scheduler:
+    """
+    Run tasks on one bounded thread pool as soon as the tasks they depend on
+    have finished.
+
+    Dependencies may name tasks that haven't been added yet, which lets a
+    task's then callback add follow up work (e.g. toggling slots once they
+    have been listed) while everything else keeps running. Tasks whose
+    dependencies failed are skipped. When more tasks are ready than there
+    are free workers, those with the highest priority go first.
+    """
+
+    def __init__(self, workers=8):
+        self.workers = workers
+        self.tasks = {}
+        self.waiting = []
+        self.succeeded = set()
+        self.failed = set()
+
+    def add(self, key, fn, *args, after=(), then=None, priority=0):
+        if key in self.tasks:
+            raise ValueError(f"{key} has already been scheduled")
+        self.tasks[key] = Task(key, fn, args, after, then, priority)
+        self.waiting.append(key)
+
+    def ready(self):
+        """
+        Split waiting tasks into those that can run and those that must be
+        skipped, leaving the rest waiting.
+        """
+        runnable, skipped, waiting = [], [], []
+        finished = self.succeeded | self.failed
+        for key in self.waiting:
+            after = self.tasks[key].after
+            if any(dep in self.failed for dep in after):
+                skipped.append(key)
+            elif all(dep in finished for dep in after):
+                runnable.append(key)
+            else:
+                waiting.append(key)
+        runnable.sort(key=lambda key: self.tasks[key].priority, reverse=True)
+        return runnable, skipped, waiting
+
+    def run(self):
+        """
+        Yield a (key, result, error) tuple for every task as it finishes.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            running = {}
+            while True:
+                runnable, skipped, self.waiting = self.ready()
+                for key in skipped:
+                    self.failed.add(key)
+                    deps = [dep for dep in self.tasks[key].after if dep in self.failed]
+                    yield key, None, AssertionError(f"Skipped, {deps} failed")
+                if skipped:
+                    continue
+
+                free = self.workers - len(running)
+                self.waiting += runnable[free:]
+                for key in runnable[:free]:
+                    task = self.tasks[key]
+                    running[executor.submit(task.fn, *task.args)] = key
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    try:
+                        result, error = future.result(), None
+                        self.succeeded.add(key)
+                    except Exception as exception:
+                        result, error = None, exception
+                        self.failed.add(key)
+                        logging.debug(f"{key} failed: {exception}")
+
+                    then = self.tasks[key].then
+                    if then and error is None:
+                        try:
+                            then(result)
+                        except Exception as exception:
+                            error = exception
+                            self.succeeded.discard(key)
+                            self.failed.add(key)
+                    yield key, result, error
+
+        for key in self.waiting:
+            missing = [dep for dep in self.tasks[key].after if dep not in self.tasks]
+            yield key, None, AssertionError(f"Never ran, {missing} were not scheduled")
@@ -0,0 +1,218 @@
+import logging
+import random
+import requests
+from threading import Lock
+from time import sleep
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from .poll import get_retry_after
+from .throttle import get_rate_limiter, get_retry_budget
+from .trace import body_size, get_tracer
+
+ARM_HOST = "management.azure.com"
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# A 5xx can come back after the request took effect, so only methods that
+# are safe to repeat are retried on one. 429s were never processed.
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+_session = None
+_pool_size = 0
+_lock = Lock()
+
+
+class RetryPolicy:
+    """
+    Retry decisions shared by AzureSession and the aiohttp clients.
+
+    Both send loops ask the policy what to do after each attempt, so the
+    rate limiter, retry budget and which failures are worth repeating only
+    live in one place.
+    """
+
+    def __init__(self, max_retries=4):
+        self.max_retries = max_retries
+        self.limiter = get_rate_limiter()
+        self.budget = get_retry_budget()
+
+    def can_retry(self, attempt, body=None):
+        """
+        Streamed bodies are only retried if they can be rewound to the start.
+        """
+        if attempt >= self.max_retries:
+            return False
+        if body is not None and not isinstance(body, (bytes, str, dict, list)):
+            if not hasattr(body, "seek"):
+                return False
+            body.seek(0)
+        return self.budget.withdraw()
+
+    def on_error(self, method, attempt, error, sent=True, body=None):
+        """
+        Return the seconds to wait before retrying after a connection error,
+        or re-raise it. Once a request may have gone out, only methods that are
+        safe to repeat are retried, as the server could have acted on it.
+        """
+        if sent and method.upper() not in IDEMPOTENT_METHODS:
+            raise error
+        if not self.can_retry(attempt, body):
+            raise error
+        logging.warning("Transient connection issue. Trying again...")
+        logging.debug(error)
+        return backoff(attempt)
+
+    def on_response(self, span, method, url, attempt, response, body=None):
+        """
+        Return the seconds to wait before retrying after response, or None
+        if it is the final one. Works for requests and aiohttp responses.
+        """
+        status = getattr(response, "status_code", None) or response.status
+        if urlparse(url).hostname == ARM_HOST:
+            self.limiter.update(method, response.headers)
+        if span and status == 429:
+            span.throttled += 1
+
+        if should_retry(method, status):
+            if self.can_retry(attempt, body):
+                delay = backoff(attempt, response)
+                logging.warning(
+                    f"{method} {urlparse(url).path} returned "
+                    + f"{status}, retrying in {delay:.1f}s..."
+                )
+                return delay
+        elif status not in RETRY_STATUSES:
+            self.budget.deposit()
+        return None
+
+
+class AzureSession(requests.Session):
+    """
+    Keep-alive session shared by every AzureExtras client.
+
+    urllib3 keeps one connection pool per host (management.azure.com and each
+    scm host), so pool_maxsize is effectively a per-host connection limit.
+    ARM requests go through the process wide rate limiter, and 429s, 5xx
+    responses and connection errors to idempotent requests, and failed
+    connections for any request, are retried with backoff while the process
+    wide retry budget lasts.
+    Each request, retries included, is reported to the tracer as one span.
+    """
+
+    def __init__(self, pool_size, max_retries=4):
+        super().__init__()
+        self.mount_adapters(pool_size)
+        self.retries = RetryPolicy(max_retries)
+
+    def mount_adapters(self, pool_size):
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            pool_block=True,
+        )
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        span = get_tracer().start(method, url)
+        try:
+            response = self.send_with_retries(span, method, url, *args, **kwargs)
+        except Exception as error:
+            if span:
+                span.finish(error=error)
+            raise
+        if span:
+            span.finish(
+                response.status_code,
+                response.headers,
+                body_size(response.request.body),
+                received_size(response, kwargs.get("stream")),
+            )
+        return response
+
+    def send_with_retries(self, span, method, url, *args, **kwargs):
+        """
+        Return the final response for a request, counting retries and 429s
+        on span when tracing.
+        """
+        arm = urlparse(url).hostname == ARM_HOST
+        body = kwargs.get("data")
+        attempt = 0
+        while True:
+            if span:
+                span.retries = attempt
+            if arm:
+                self.retries.limiter.acquire(method)
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except requests.exceptions.ConnectionError as error:
+                sent = not never_sent(error)
+                sleep(self.retries.on_error(method, attempt, error, sent, body))
+                attempt += 1
+                continue
+
+            delay = self.retries.on_response(span, method, url, attempt, response, body)
+            if delay is None:
+                return response
+            response.close()
+            sleep(delay)
+            attempt += 1
+
+
+def should_retry(method, status):
+    if status == 429:
+        return True
+    return status in RETRY_STATUSES and method.upper() in IDEMPOTENT_METHODS
+
+
+def never_sent(error):
+    """
+    Whether a requests ConnectionError happened before the request went out.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def backoff(attempt, response=None):
+    """
+    Seconds to wait before retry attempt, from the response's Retry-After
+    header if it has one, and exponential backoff with jitter otherwise.
+    Works for requests and aiohttp responses alike.
+    """
+    delay = get_retry_after(response)
+    if delay is None:
+        delay = min(30, 2**attempt) * random.uniform(0.5, 1.5)
+    return delay
+
+
+def received_size(response, stream=False):
+    """
+    Bytes in the response body, without reading streamed bodies.
+    """
+    if not stream:
+        return len(response.content)
+    length = response.headers.get("Content-Length")
+    return int(length) if length and length.isdigit() else None
+
+
+def get_session(pool_size=10):
+    """
+    Return the process wide session, growing its pools if a caller needs more
+    concurrent connections than it was created with.
+    """
+    global _session, _pool_size
+
+    with _lock:
+        if _session is None:
+            logging.debug(
+                f"Creating HTTP session with {pool_size} connections per host"
+            )
+            _session = AzureSession(pool_size)
+            _pool_size = pool_size
+        elif pool_size > _pool_size:
+            logging.debug(f"Growing HTTP session to {pool_size} connections per host")
+            _session.mount_adapters(pool_size)
+            _pool_size = pool_size
+
+    return _session
@@ -0,0 +1,148 @@
+import logging
+from threading import Lock
+from time import monotonic, sleep
+
+READ_HEADER = "x-ms-ratelimit-remaining-subscription-reads"
+WRITE_HEADER = "x-ms-ratelimit-remaining-subscription-writes"
+
+_limiter = None
+_budget = None
+_lock = Lock()
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.lock = Lock()
+
+    def refill(self):
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """
+        Take a token if there is one and return 0, or return how many seconds
+        to wait before trying again.
+        """
+        with self.lock:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self.take()
+            if not wait:
+                return
+            sleep(wait)
+
+    async def acquire_async(self):
+        # Imported here so the sync clients don't pay for asyncio.
+        import asyncio
+
+        while True:
+            wait = self.take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class RateLimiter:
+    """
+    Process wide token buckets for ARM subscription reads and writes.
+
+    ARM reports how many requests are left in the current window through the
+    x-ms-ratelimit-remaining-subscription-* headers. Once that drops below
+    low_watermark the bucket refill rate is scaled down in proportion, so
+    workers slow down before the quota runs out rather than after a 429.
+    """
+
+    def __init__(self, read_rate=25, write_rate=10, low_watermark=200):
+        self.low_watermark = low_watermark
+        self.reads = TokenBucket(read_rate, 250)
+        self.writes = TokenBucket(write_rate, 200)
+
+    def bucket(self, method):
+        return self.reads if method.upper() in ("GET", "HEAD") else self.writes
+
+    def acquire(self, method):
+        self.bucket(method).acquire()
+
+    async def acquire_async(self, method):
+        await self.bucket(method).acquire_async()
+
+    def update(self, method, headers):
+        header = READ_HEADER if method.upper() in ("GET", "HEAD") else WRITE_HEADER
+        remaining = headers.get(header)
+        if remaining is None:
+            return
+
+        bucket = self.bucket(method)
+        scale = min(1.0, max(0.05, int(remaining) / self.low_watermark))
+        with bucket.lock:
+            if scale < 1.0 and bucket.rate != bucket.base_rate * scale:
+                logging.debug(
+                    f"{remaining} ARM {method} requests left, "
+                    + f"throttling to {bucket.base_rate * scale:.2f}/s"
+                )
+            bucket.rate = bucket.base_rate * scale
+
+
+class RetryBudget:
+    """
+    Bound retries across every thread in the process.
+
+    Each successful request deposits ratio of a retry, up to capacity, and
+    every retry withdraws one. When the budget is spent failures are raised
+    straight away instead of piling more load onto a throttled endpoint.
+    """
+
+    def __init__(self, capacity=20, ratio=0.2):
+        self.capacity = capacity
+        self.ratio = ratio
+        self.balance = capacity
+        self.lock = Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.balance = min(self.capacity, self.balance + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            if self.balance >= 1:
+                self.balance -= 1
+                return True
+            return False
+
+
+def get_rate_limiter():
+    """
+    Return the process wide RateLimiter, shared by the sync and asyncio
+    clients.
+    """
+    global _limiter
+
+    with _lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+    return _limiter
+
+
+def get_retry_budget():
+    """
+    Return the process wide RetryBudget, shared by the sync and asyncio
+    clients.
+    """
+    global _budget
+
+    with _lock:
+        if _budget is None:
+            _budget = RetryBudget()
+    return _budget
@@ -0,0 +1,295 @@
+import atexit
+import json
+import logging
+import re
+import sys
+from threading import Lock
+from time import perf_counter, time
+from urllib.parse import urlsplit
+
+RATELIMIT_HEADERS = (
+    "x-ms-ratelimit-remaining-subscription-reads",
+    "x-ms-ratelimit-remaining-subscription-writes",
+    "x-ms-ratelimit-remaining-subscription-resource-requests",
+    "Retry-After",
+)
+SCM_SUFFIX = ".scm.azurewebsites.net"
+
+# ARM path segments that are followed by the name of a resource.
+COLLECTIONS = {
+    "subscriptions": "{subscription}",
+    "resourceGroups": "{resourceGroup}",
+    "sites": "{site}",
+    "slots": "{slot}",
+    "streamingjobs": "{job}",
+    "locations": "{location}",
+    "operationResults": "{operation}",
+    "deployments": "{deployment}",
+}
+# Kudu endpoints that take a path on the app's file system.
+KUDU_PATH = re.compile(r"^/api/(vfs|zip|logstream)/.+?(/?)$")
+
+_tracer = None
+_lock = Lock()
+
+
+def endpoint_template(url):
+    """
+    Return (host, template) for url, with resource names, file paths and
+    credentials replaced by placeholders, so requests for different apps
+    group together.
+    """
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    if host.endswith(SCM_SUFFIX):
+        host = "{app}" + SCM_SUFFIX
+        return host, KUDU_PATH.sub(r"/api/\1/{path}\2", parts.path)
+
+    segments = parts.path.split("/")
+    for i in range(1, len(segments)):
+        if segments[i - 1] in COLLECTIONS and segments[i]:
+            segments[i] = COLLECTIONS[segments[i - 1]]
+    return host, "/".join(segments)
+
+
+def body_size(body):
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode())
+    try:
+        return len(body)
+    except TypeError:
+        return None
+
+
+class Span:
+    """
+    One logical request, including any retries, as it is being timed.
+    """
+
+    def __init__(self, tracer, method, url):
+        self.tracer = tracer
+        self.method = method.upper()
+        self.host, self.template = endpoint_template(url)
+        self.start = time()
+        self.started = perf_counter()
+        self.retries = 0
+        self.throttled = 0
+
+    def finish(self, status=None, headers=None, sent=None, received=None, error=None):
+        headers = headers or {}
+        duration = perf_counter() - self.started
+        self.tracer.emit(
+            {
+                "name": f"{self.method} {self.template}",
+                "method": self.method,
+                "host": self.host,
+                "template": self.template,
+                "start": self.start,
+                "end": self.start + duration,
+                "duration": duration,
+                "status": status,
+                "sent": sent,
+                "received": received,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "ratelimit": {
+                    name: headers[name] for name in RATELIMIT_HEADERS if name in headers
+                },
+                "error": f"{type(error).__name__}: {error}" if error else None,
+            }
+        )
+
+
+class Tracer:
+    """
+    Hands a record of every HTTP request to the registered hooks.
+
+    Hooks are callables taking the record dict, such as JsonLinesHook,
+    SummaryHook or OpenTelemetryHook. With no hooks registered nothing is
+    recorded.
+    """
+
+    def __init__(self):
+        self.hooks = []
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+        return hook
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def start(self, method, url):
+        """
+        Return a Span to finish once the request is done, or None when
+        tracing is off.
+        """
+        if not self.hooks:
+            return None
+        return Span(self, method, url)
+
+    def emit(self, record):
+        for hook in list(self.hooks):
+            try:
+                hook(record)
+            except Exception as error:
+                logging.debug(f"Trace hook {hook} failed: {error}")
+
+
+class JsonLinesHook:
+    """
+    Append every record to path as a line of json.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a")
+        self.lock = Lock()
+        atexit.register(self.close)
+
+    def __call__(self, record):
+        line = json.dumps(record)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class SummaryHook:
+    """
+    Aggregate records per method and endpoint template.
+    """
+
+    def __init__(self):
+        self.endpoints = {}
+        self.lock = Lock()
+
+    def __call__(self, record):
+        key = (record["method"], record["host"], record["template"])
+        with self.lock:
+            stats = self.endpoints.setdefault(
+                key,
+                {
+                    "calls": 0,
+                    "errors": 0,
+                    "retries": 0,
+                    "throttled": 0,
+                    "received": 0,
+                    "durations": [],
+                },
+            )
+            stats["calls"] += 1
+            failed = record["error"] or (record["status"] or 0) >= 400
+            stats["errors"] += 1 if failed else 0
+            stats["retries"] += record["retries"]
+            stats["throttled"] += record["throttled"]
+            stats["received"] += record["received"] or 0
+            stats["durations"].append(record["duration"])
+
+    def table(self):
+        lines = [
+            f"{'endpoint':<60} {'calls':>6} {'errors':>6} {'retries':>7} "
+            + f"{'429s':>5} {'recv MB':>8} {'total s':>8} {'p50 ms':>7} {'p99 ms':>7}"
+        ]
+        with self.lock:
+            endpoints = sorted(
+                self.endpoints.items(), key=lambda item: -sum(item[1]["durations"])
+            )
+            for (method, host, template), stats in endpoints:
+                durations = sorted(stats["durations"])
+                p50 = durations[int(0.5 * (len(durations) - 1))]
+                p99 = durations[int(0.99 * (len(durations) - 1))]
+                # The subscription and resource group are the same every time.
+                path = template.split("/providers/", 1)[-1]
+                name = f"{method} {'scm ' if host.endswith(SCM_SUFFIX) else ''}{path}"
+                lines.append(
+                    f"{name[:60]:<60} {stats['calls']:>6} {stats['errors']:>6} "
+                    + f"{stats['retries']:>7} {stats['throttled']:>5} "
+                    + f"{stats['received'] / 1024 / 1024:>8.1f} "
+                    + f"{sum(durations):>8.2f} {p50 * 1000:>7.0f} {p99 * 1000:>7.0f}"
+                )
+        return "\n".join(lines)
+
+    def print_table(self):
+        if self.endpoints:
+            print(self.table(), file=sys.stderr)
+
+
+class OpenTelemetryHook:
+    """
+    https://opentelemetry.io/docs/specs/semconv/http/http-spans/
+
+    Turn every record into an OpenTelemetry client span, exported by
+    whichever tracer provider has been configured (e.g. by running under
+    opentelemetry-instrument).
+    """
+
+    def __init__(self, name="azure_extras"):
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            raise ImportError("Install opentelemetry-api to export spans.")
+        self.trace = trace
+        self.tracer = trace.get_tracer(name)
+
+    def __call__(self, record):
+        attributes = {
+            "http.request.method": record["method"],
+            "server.address": record["host"],
+            "url.template": record["template"],
+            "http.request.resend_count": record["retries"],
+            "azure.throttled_count": record["throttled"],
+        }
+        if record["status"] is not None:
+            attributes["http.response.status_code"] = record["status"]
+        if record["sent"] is not None:
+            attributes["http.request.body.size"] = record["sent"]
+        if record["received"] is not None:
+            attributes["http.response.body.size"] = record["received"]
+        for name, value in record["ratelimit"].items():
+            attributes[f"azure.{name.lower()}"] = value
+        if record["error"]:
+            attributes["error.type"] = record["error"].split(":", 1)[0]
+
+        span = self.tracer.start_span(
+            record["name"],
+            kind=self.trace.SpanKind.CLIENT,
+            start_time=int(record["start"] * 1e9),
+            attributes=attributes,
+        )
+        if record["error"] or (record["status"] or 0) >= 400:
+            span.set_status(self.trace.Status(self.trace.StatusCode.ERROR))
+        span.end(end_time=int(record["end"] * 1e9))
+
+
+def get_tracer():
+    """
+    Return the process wide Tracer.
+    """
+    global _tracer
+
+    with _lock:
+        if _tracer is None:
+            _tracer = Tracer()
+    return _tracer
+
+
+def enable_tracing(path=None, otel=False, summary=False):
+    """
+    Register the hooks asked for on the command line: a json lines trace
+    file at path, OpenTelemetry spans and/or a summary table printed to
+    stderr at exit.
+    """
+    tracer = get_tracer()
+    if path:
+        tracer.add_hook(JsonLinesHook(path))
+    if otel:
+        tracer.add_hook(OpenTelemetryHook())
+    if summary:
+        atexit.register(tracer.add_hook(SummaryHook()).print_table)
+    return tracer
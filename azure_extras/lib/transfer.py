@@ -0,0 +1,202 @@
+import hashlib
+import logging
+import os
+from time import time
+
+CHUNK_SIZE = 1024 * 1024
+MB = 1024 * 1024
+
+
+class Progress:
+    """
+    Log how far a transfer has got, and how fast, at most every interval
+    seconds.
+    """
+
+    def __init__(self, description, total=None, interval=2):
+        self.description = description
+        self.total = total
+        self.interval = interval
+        self.reset()
+
+    def reset(self, done=0):
+        self.done = done
+        self.start = time()
+        self.start_done = done
+        self.reported = self.start
+
+    @property
+    def throughput(self):
+        elapsed = time() - self.start
+        return (self.done - self.start_done) / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        total = f"/{self.total / MB:.1f}" if self.total else ""
+        return (
+            f"{self.description}: {self.done / MB:.1f}{total} MB "
+            + f"({self.throughput / MB:.1f} MB/s)"
+        )
+
+    def update(self, count):
+        self.done += count
+        if time() - self.reported >= self.interval:
+            self.reported = time()
+            logging.info(str(self))
+
+    def finish(self):
+        logging.info(f"{self} in {time() - self.start:.1f}s")
+
+
+class ProgressFile:
+    """
+    Read only file wrapper that streams a file as a request body in fixed
+    size chunks, reporting progress and optionally hashing it as it goes.
+
+    It is deliberately only iterable, with no read() method, since
+    http.client reads file objects in its own 16 KiB blocks, which would make
+    chunk_size meaningless. len() gives requests the Content-Length, so the
+    body isn't sent chunked.
+    """
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE, checksum=None, description=None):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.chunk_size = chunk_size
+        self.algorithm = checksum
+        self.file = open(path, "rb")
+        self.progress = Progress(description or f"Uploading {path}", self.size)
+        self.hash = hashlib.new(checksum) if checksum else None
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        while True:
+            chunk = self.file.read(self.chunk_size)
+            if not chunk:
+                break
+            self.progress.update(len(chunk))
+            if self.hash:
+                self.hash.update(chunk)
+            yield chunk
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """
+        Only rewinding is supported, so a retried request can resend the body.
+        """
+        if offset != 0 or whence != os.SEEK_SET:
+            raise OSError("ProgressFile can only be rewound to the start")
+        self.file.seek(0)
+        self.progress.reset()
+        self.hash = hashlib.new(self.algorithm) if self.algorithm else None
+        return 0
+
+    def tell(self):
+        return self.file.tell()
+
+    def hexdigest(self):
+        return self.hash.hexdigest() if self.hash else None
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def validator(response):
+    """
+    The strong validator for a response that If-Range can use to make sure a
+    resumed download is of the same content, or None if it doesn't have one.
+    https://www.rfc-editor.org/rfc/rfc9110#name-if-range
+    """
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+
+def resume_point(partial):
+    """
+    How much of partial has been downloaded, and the validator it was
+    downloaded with, or nothing if it can't be safely resumed.
+    """
+    try:
+        with open(f"{partial}.validator") as f:
+            return os.path.getsize(partial), f.read()
+    except OSError:
+        return 0, None
+
+
+def discard(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def download(session, url, destination, chunk_size=CHUNK_SIZE, attempts=3, **kwargs):
+    """
+    Stream url to destination in chunk_size pieces via destination.part,
+    renaming it into place once complete. If the transfer is interrupted, it
+    is resumed with a Range request, either straight away (up to attempts
+    times) or by the next call for the same destination.
+
+    Only responses with an ETag or Last-Modified header are resumed, and the
+    Range is sent with If-Range, so a partial file is never stitched
+    together with a different version of the content.
+    """
+    partial = f"{destination}.part"
+    headers = dict(kwargs.pop("headers", None) or {})
+    progress = Progress(f"Downloading {url}")
+    attempt = 0
+
+    while True:
+        offset, etag = resume_point(partial)
+        headers.pop("Range", None)
+        headers.pop("If-Range", None)
+        if offset:
+            logging.info(f"Resuming {url} from byte {offset}")
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = etag
+
+        try:
+            with session.get(url, headers=headers, stream=True, **kwargs) as response:
+                logging.debug(response.headers)
+                if response.status_code == 416 and offset:
+                    # The partial file doesn't match what's there now.
+                    logging.warning(f"Can't resume {url}, starting again")
+                    discard(partial, f"{partial}.validator")
+                    continue
+                if response.ok is False:
+                    return response
+                if response.status_code != 206:
+                    # A full response, either fresh or because If-Range failed.
+                    offset = 0
+                    etag = validator(response)
+                    discard(f"{partial}.validator")
+                length = response.headers.get("Content-Length")
+                progress.total = offset + int(length) if length else None
+                progress.reset(offset)
+
+                with open(partial, "ab" if offset else "wb") as f:
+                    if etag and not offset:
+                        with open(f"{partial}.validator", "w") as v:
+                            v.write(etag)
+                    for chunk in response.iter_content(chunk_size):
+                        f.write(chunk)
+                        progress.update(len(chunk))
+            break
+        except OSError as error:
+            # requests' ConnectionError and ChunkedEncodingError are OSErrors.
+            attempt += 1
+            if attempt == attempts:
+                raise error
+            logging.warning(f"Download of {url} interrupted, resuming: {error}")
+
+    os.replace(partial, destination)
+    discard(f"{partial}.validator")
+    progress.finish()
+    return response
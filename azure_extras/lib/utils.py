@@ -1,5 +1,7 @@
+import json
 import logging
 import os
+import subprocess
 import sys
 from argparse import ArgumentTypeError
 
@@ -11,6 +13,81 @@ def chkpath(path):
     raise ArgumentTypeError(f"{path} does not exist.")
 
 
+def chkpositive(value):
+    if value.isdigit() and int(value) > 0:
+        return int(value)
+
+    raise ArgumentTypeError(f"{value} is not a positive whole number.")
+
+
+def add_selector_args(parser):
+    """
+    Options for picking resources from the resource group instead of
+    naming them explicitly.
+    """
+    parser.add_argument(
+        "-t",
+        "--tag",
+        metavar=("NAME[=VALUE]"),
+        help="select resources with this tag when none are named",
+    )
+    parser.add_argument(
+        "-R",
+        "--regex",
+        metavar=("PATTERN"),
+        help="select resources whose names match this pattern when none are named",
+    )
+    parser.add_argument(
+        "-S",
+        "--state",
+        metavar=("STATE"),
+        help="select resources in this state (e.g. Running) when none are named",
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="select every resource in the group when none are named",
+    )
+
+
+def select(names, args, find, kind):
+    """
+    Return the resources named on the command line, or else the ones
+    find(tag, regex, state) picks with the selector options. Selecting the
+    whole resource group has to be asked for with --all.
+    """
+    if names:
+        return names
+    if not (args.tag or args.regex or args.state or args.all):
+        raise SystemExit(f"Name the {kind}, select them with -t/-R/-S, or use --all.")
+
+    found = find(args.tag, args.regex, args.state)
+    if not found:
+        raise SystemExit(f"No matching {kind} found.")
+    return found
+
+
+def add_trace_args(parser):
+    """
+    Options for recording every HTTP request made.
+    """
+    parser.add_argument(
+        "--trace",
+        metavar=("PATH"),
+        help="append a json lines record of every HTTP request to PATH",
+    )
+    parser.add_argument(
+        "--otel",
+        action="store_true",
+        help="export every HTTP request as an OpenTelemetry span",
+    )
+    parser.add_argument(
+        "--summary",
+        action="store_true",
+        help="print request counts and timings per endpoint at exit",
+    )
+
+
 def mklog(verbosity):
     if verbosity > 1:
         loglevel = logging.DEBUG
@@ -29,3 +106,36 @@ def mklog(verbosity):
         level=loglevel,
         stream=sys.stdout,
     )
+
+
+def get_cmd_stdout(cmd):
+    # run() reads the pipe while waiting, where wait() before communicate()
+    # blocks forever once the output fills the pipe's buffer.
+    process = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE)
+    return process.stdout.decode("utf-8")
+
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".azure_extras")
+
+
+def read_cache(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_cache(path, data):
+    """
+    Atomically write data as json to a file only the current user can read,
+    since caches hold tokens and publishing credentials.
+    """
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        fd = os.open(f"{path}.tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(f"{path}.tmp", path)
+    except OSError as error:
+        logging.debug(f"Failed to write cache {path}: {error}")
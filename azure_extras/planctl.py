@@ -0,0 +1,93 @@
+import logging
+import os
+from argparse import ArgumentParser
+from .lib.plan import PlanRunner, load_plan, simulate
+from .lib.trace import enable_tracing
+from .lib.utils import add_trace_args, chkpath, chkpositive, mklog
+
+
+def get_args():
+    parser = ArgumentParser(
+        description="Start or stop App Services, slots, health checks and "
+        + "Stream Analytics Jobs following a dependency plan"
+    )
+    parser.add_argument(
+        "-p",
+        "--plan",
+        type=chkpath,
+        required=True,
+        metavar=("PATH"),
+        help="path to a YAML or INI plan",
+    )
+    parser.add_argument(
+        "-C",
+        "--config",
+        type=chkpath,
+        metavar=("PATH"),
+        default=f"{os.path.expanduser('~')}/.azure.ini",
+        help="path to azure configuration file",
+    )
+    parser.add_argument(
+        "-n",
+        "--concurrency",
+        type=chkpositive,
+        default=20,
+        metavar=("N"),
+        help="maximum steps to run at once",
+    )
+    parser.add_argument(
+        "-d",
+        "--dry_run",
+        action="store_true",
+        help="print the expected schedule without changing anything",
+    )
+    add_trace_args(parser)
+    parser.add_argument("-v", action="count", default=0, help="increase verbosity")
+    return parser.parse_args()
+
+
+def read_plan(path):
+    try:
+        return load_plan(path)
+    except KeyError as error:
+        raise SystemExit(f"{path} is missing {error}")
+    except ValueError as error:
+        raise SystemExit(f"{path}: {error}")
+
+
+def dry_run(steps, workers):
+    schedule = simulate(steps, workers)
+    for start, end, step in schedule:
+        after = f" (after {', '.join(step.after)})" if step.after else ""
+        print(f"{start:>7.0f}s - {end:>7.0f}s  {step.key}: {step}{after}")
+    finish = max((end for _, end, _ in schedule), default=0)
+    print(f"Expected to finish in {finish:.0f}s.")
+
+
+def planctl(config, plan, workers):
+    rg, steps = read_plan(plan)
+    runner = PlanRunner(config, rg, steps, workers)
+    failures = 0
+    for step, result, error in runner.run():
+        if error:
+            failures += 1
+            print(f"{step.key}: {step}.. FAILED.")
+            logging.error(error)
+        else:
+            print(f"{step.key}: {step}.. {str(result).upper()}.")
+    return failures
+
+
+def main():
+    args = get_args()
+    mklog(args.v)
+    enable_tracing(args.trace, args.otel, args.summary)
+    if args.dry_run:
+        rg, steps = read_plan(args.plan)
+        dry_run(steps, args.concurrency)
+    elif planctl(args.config, args.plan, args.concurrency):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
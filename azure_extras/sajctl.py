@@ -3,8 +3,10 @@ import logging
 
 from argparse import ArgumentParser
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from .lib.reconcile import print_report, reconcile_stream_analytics_jobs
 from .lib.saj import StreamAnalyticsJobs
-from .lib.utils import chkpath, mklog
+from .lib.trace import enable_tracing
+from .lib.utils import add_selector_args, add_trace_args, chkpath, mklog, select
 
 
 def get_args():
@@ -33,12 +35,38 @@ def get_args():
         metavar=("START/STOP"),
         help="action to carry out - start or stop.",
     )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        action="store_true",
+        help="send toggles and status checks as ARM batch requests",
+    )
+    parser.add_argument(
+        "--aio",
+        action="store_true",
+        help="drive every job from a single asyncio event loop",
+    )
+    parser.add_argument(
+        "-n",
+        "--concurrency",
+        type=int,
+        default=20,
+        metavar=("N"),
+        help="maximum concurrent requests when using --aio",
+    )
+    parser.add_argument(
+        "--reconcile",
+        action="store_true",
+        help="read current state in bulk and only send writes to jobs that differ",
+    )
+    add_selector_args(parser)
+    add_trace_args(parser)
     parser.add_argument("-v", action="count", default=0, help="increase verbosity")
     return parser.parse_args()
 
 
 def sajctl(config, rg, jobs, action):
-    saj = StreamAnalyticsJobs(config, rg)
+    saj = StreamAnalyticsJobs(config, rg, pool_size=len(jobs))
     print(f"Sending {action} to " + ", ".join(jobs) + "...")
 
     # http://masnun.com/2016/03/29/python-a-quick-introduction-to-the-concurrent-futures-module.html
@@ -59,10 +87,76 @@ def sajctl(config, rg, jobs, action):
                 print(result["properties"]["jobState"].upper())
 
 
+def sajctl_aio(config, rg, jobs, action, concurrency):
+    # asyncio and aiohttp are only needed with --aio.
+    import asyncio
+    from .lib.aio import AsyncStreamAnalyticsJobs
+
+    async def run():
+        print(f"Sending {action} to " + ", ".join(jobs) + "...")
+        async with AsyncStreamAnalyticsJobs(config, rg, concurrency) as saj:
+
+            async def toggle(job):
+                try:
+                    result = await saj.toggle_stream_analytics_job(job, action)
+                except (ValueError, AssertionError) as error:
+                    print(f"Status of {job}: FAILED")
+                    logging.error(error)
+                else:
+                    print(
+                        f"Status of {job}: " + result["properties"]["jobState"].upper()
+                    )
+
+            await asyncio.gather(*(toggle(job) for job in jobs))
+
+    asyncio.run(run())
+
+
+def sajctl_batch(config, rg, jobs, action):
+    saj = StreamAnalyticsJobs(config, rg)
+    print(f"Sending {action} to " + ", ".join(jobs) + "...")
+
+    for job, status in saj.toggle_many(jobs, action).items():
+        print(f"Status of {job}: {status.upper() if status else 'FAILED'}")
+
+
+def sajctl_reconcile(config, rg, jobs, action):
+    saj = StreamAnalyticsJobs(config, rg)
+    print_report(reconcile_stream_analytics_jobs(saj, jobs, action), action)
+
+
 def main():
     args = get_args()
     mklog(args.v)
-    sajctl(args.config, args.resource_group, args.stream_analytics_jobs, args.action)
+    enable_tracing(args.trace, args.otel, args.summary)
+    args.stream_analytics_jobs = select(
+        args.stream_analytics_jobs,
+        args,
+        lambda *selectors: StreamAnalyticsJobs(
+            args.config, args.resource_group
+        ).select_stream_analytics_jobs(*selectors),
+        "jobs",
+    )
+    if args.aio:
+        sajctl_aio(
+            args.config,
+            args.resource_group,
+            args.stream_analytics_jobs,
+            args.action,
+            args.concurrency,
+        )
+    elif args.reconcile:
+        sajctl_reconcile(
+            args.config, args.resource_group, args.stream_analytics_jobs, args.action
+        )
+    elif args.batch:
+        sajctl_batch(
+            args.config, args.resource_group, args.stream_analytics_jobs, args.action
+        )
+    else:
+        sajctl(
+            args.config, args.resource_group, args.stream_analytics_jobs, args.action
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,787 @@
+"""
+Local stand-in for the management.azure.com and scm endpoints azure_extras
+uses, so changes can be benchmarked without a live subscription.
+
+Requests are routed by the X-Forwarded-Host header the benchmark adapter
+adds, so the library's real urls (and their rate limiting, retries and
+caching) are used unchanged. Run it on its own with:
+
+    python -m benchmarks.fakeazure --apps 50 --latency 40
+"""
+import json
+import logging
+import random
+import re
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+from time import sleep, time
+from urllib.parse import parse_qs, urlsplit
+
+ARM_HOST = "management.azure.com"
+SCM_SUFFIX = ".scm.azurewebsites.net"
+LINE_WIDTH = 100
+PAGE_SIZE = 100
+
+ARM_ROUTES = [
+    ("POST", r"/batch", "batch"),
+    ("GET", r"(?P<path>/.*/resources)", "resources"),
+    ("GET", r"/.*/operationResults/(?P<op>[^/]+)", "operation"),
+    ("GET", r"/.*/sites/(?P<app>[^/]+)/slots", "slots"),
+    ("GET", r"/.*/sites/(?P<app>[^/]+)/slots/(?P<slot>[^/]+)", "site"),
+    (
+        "POST",
+        r"/.*/sites/(?P<app>[^/]+)/slots/(?P<slot>[^/]+)/(?P<action>start|stop)",
+        "toggle_site",
+    ),
+    ("GET", r"/.*/sites/(?P<app>[^/]+)/instances", "instances"),
+    ("GET", r"/.*/sites/(?P<app>[^/]+)/config/web", "web_config"),
+    ("PATCH", r"/.*/sites/(?P<app>[^/]+)/config/web", "patch_web_config"),
+    (
+        "POST",
+        r"/.*/sites/(?P<app>[^/]+)/config/publishingcredentials/list",
+        "publishing_credentials",
+    ),
+    ("POST", r"/.*/sites/(?P<app>[^/]+)/(?P<action>start|stop)", "toggle_site"),
+    ("GET", r"/.*/sites/(?P<app>[^/]+)", "site"),
+    ("GET", r"/.*/streamingjobs/(?P<job>[^/]+)", "job"),
+    ("POST", r"/.*/streamingjobs/(?P<job>[^/]+)/(?P<action>start|stop)", "toggle_job"),
+]
+
+SCM_ROUTES = [
+    ("GET", r"/api/vfs/(?P<path>.*)", "vfs"),
+    ("PUT", r"/api/vfs/(?P<path>.*)", "put_vfs"),
+    ("DELETE", r"/api/vfs/(?P<path>.*)", "delete_vfs"),
+    ("GET", r"/api/zip/(?P<path>.*)", "zip"),
+    ("PUT", r"/api/zipdeploy", "zipdeploy"),
+    ("POST", r"/api/zipdeploy", "zipdeploy"),
+    ("GET", r"/api/deployments/(?P<deployment>[^/]+)", "deployment"),
+    ("POST", r"/api/command", "command"),
+    ("GET", r"/api/(?P<endpoint>.*)", "endpoint"),
+]
+
+
+def compile_routes(routes):
+    return [
+        (method, re.compile(pattern + "$"), name) for method, pattern, name in routes
+    ]
+
+
+class Resource:
+    """
+    Something with a state that takes transition seconds to change.
+    """
+
+    def __init__(self, state, transition):
+        self.state = state
+        self.previous = state
+        self.ready_at = 0
+        self.transition = transition
+        self.version = 0
+
+    def current(self, transient=None):
+        if time() < self.ready_at:
+            return transient or self.previous
+        return self.state
+
+    def change(self, state):
+        if state != self.current():
+            self.previous = self.current()
+            self.state = state
+            self.ready_at = time() + self.transition
+        self.version += 1
+
+    @property
+    def etag(self):
+        return f'W/"{self.version}-{self.current()}"'
+
+
+class Bucket:
+    """
+    ARM style per subscription request budget, refilled at rate per second.
+    A rate of 0 never throttles.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst or rate * 10
+        self.tokens = self.capacity
+        self.updated = time()
+        self.lock = Lock()
+
+    def take(self):
+        """
+        Return (allowed, remaining).
+        """
+        if not self.rate:
+            return True, 11999
+        with self.lock:
+            now = time()
+            refill = (now - self.updated) * self.rate
+            self.tokens = min(self.capacity, self.tokens + refill)
+            self.updated = now
+            if self.tokens < 1:
+                return False, 0
+            self.tokens -= 1
+            return True, int(self.tokens)
+
+
+class FakeAzure:
+    """
+    In memory state for a resource group of apps (with slots and instances)
+    and Stream Analytics jobs, plus a synthetic log tree per app.
+
+    Log files are made of fixed width, time ordered lines generated on the
+    fly, so trees of any size cost no memory and Range requests can be
+    answered without building the whole file.
+    """
+
+    def __init__(
+        self,
+        apps=20,
+        slots=1,
+        instances=2,
+        jobs=10,
+        latency=0.0,
+        jitter=0.0,
+        transition=1.0,
+        read_rate=0,
+        write_rate=0,
+        burst=0,
+        log_dirs=4,
+        log_files=10,
+        log_size=256 * 1024,
+        zip_size=16 * 1024 * 1024,
+        stopped=0.0,
+    ):
+        self.options = dict(
+            apps=apps,
+            slots=slots,
+            instances=instances,
+            jobs=jobs,
+            latency=latency,
+            jitter=jitter,
+            transition=transition,
+            read_rate=read_rate,
+            write_rate=write_rate,
+            burst=burst,
+            log_dirs=log_dirs,
+            log_files=log_files,
+            log_size=log_size,
+            zip_size=zip_size,
+            stopped=stopped,
+        )
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self, **options):
+        """
+        Rebuild the resource group, applying any changed options, and clear
+        the request counters.
+        """
+        self.options.update(options)
+        for name, value in self.options.items():
+            setattr(self, name, value)
+
+        rng = random.Random(0)
+        transition = self.transition
+        with self.lock:
+            self.sites = {}
+            self.health = {}
+            for i in range(self.apps):
+                app = f"app-{i:03d}"
+                state = "Stopped" if rng.random() < self.stopped else "Running"
+                self.sites[app] = Resource(state, transition)
+                self.health[app] = None
+                for j in range(self.slots):
+                    self.sites[f"{app}/slots/slot-{j}"] = Resource(state, transition)
+            self.streamingjobs = {}
+            for i in range(self.jobs):
+                state = "Stopped" if rng.random() < self.stopped else "Running"
+                self.streamingjobs[f"job-{i:03d}"] = Resource(state, transition)
+            self.operations = {}
+            self.deployments = {}
+            self.counts = {}
+            self.requests = 0
+            self.throttled = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+        self.reads = Bucket(self.read_rate, self.burst)
+        self.writes = Bucket(self.write_rate, self.burst)
+
+    def count(self, operation):
+        with self.lock:
+            self.counts[operation] = self.counts.get(operation, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "operations": dict(sorted(self.counts.items())),
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+            }
+
+    @property
+    def file_size(self):
+        return self.log_size - self.log_size % LINE_WIDTH
+
+    def delay(self):
+        if self.latency or self.jitter:
+            sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    # ARM
+
+    def arm(self, method, path, query, body, etag=None):
+        """
+        Return (status, headers, body) for an ARM request, after charging it
+        to the subscription's read or write budget. Batches are only charged
+        for the requests inside them.
+        """
+        for route_method, pattern, name in self.arm_routes:
+            match = pattern.match(path)
+            if route_method == method and match:
+                break
+        else:
+            self.count(f"{method} unknown")
+            return 404, {}, {"error": {"code": "NotFound", "message": path}}
+
+        self.count(f"{method} {name}")
+        if name == "batch":
+            return self.arm_batch(body)
+
+        bucket = self.reads if method == "GET" else self.writes
+        allowed, remaining = bucket.take()
+        kind = "reads" if method == "GET" else "writes"
+        headers = {f"x-ms-ratelimit-remaining-subscription-{kind}": str(remaining)}
+        if not allowed:
+            with self.lock:
+                self.throttled += 1
+            headers["Retry-After"] = "1"
+            return 429, headers, {"error": {"code": "TooManyRequests"}}
+
+        kwargs = match.groupdict()
+        if name == "site":
+            kwargs["etag"] = etag
+        status, extra, content = getattr(self, f"arm_{name}")(query, body, **kwargs)
+        headers.update(extra)
+        return status, headers, content
+
+    def arm_batch(self, body):
+        responses = []
+        for request in body["requests"]:
+            url = urlsplit(request["url"])
+            status, headers, content = self.arm(
+                request["httpMethod"],
+                url.path,
+                parse_qs(url.query),
+                request.get("content"),
+            )
+            responses.append(
+                {
+                    "name": request["name"],
+                    "httpStatusCode": status,
+                    "headers": headers,
+                    "content": content,
+                }
+            )
+        return 200, {}, {"responses": responses}
+
+    def arm_resources(self, query, body, path):
+        odata = query.get("$filter", [""])[0]
+        sites = [
+            {"name": app, "type": "Microsoft.Web/sites", "tags": {"fake": "true"}}
+            for app in self.sites
+            if "/" not in app
+        ]
+        jobs = [
+            {
+                "name": job,
+                "type": "Microsoft.StreamAnalytics/streamingjobs",
+                "tags": {"fake": "true"},
+            }
+            for job in self.streamingjobs
+        ]
+        if "streamingjobs" in odata:
+            resources = jobs
+        elif "Microsoft.Web" in odata:
+            resources = sites
+        else:
+            resources = sites + jobs
+        skip = int(query.get("$skiptoken", ["0"])[0])
+        page = {"value": resources[skip : skip + PAGE_SIZE]}
+        if skip + PAGE_SIZE < len(resources):
+            page["nextLink"] = (
+                f"https://{ARM_HOST}{path}?$filter={odata}"
+                + f"&$skiptoken={skip + PAGE_SIZE}"
+            )
+        return 200, {}, page
+
+    def arm_site(self, query, body, app, slot=None, etag=None):
+        name = f"{app}/slots/{slot}" if slot else app
+        site = self.sites.get(name)
+        if site is None:
+            return 404, {}, {"error": {"code": "ResourceNotFound"}}
+        if etag == site.etag:
+            return 304, {"ETag": site.etag}, None
+        return (
+            200,
+            {"ETag": site.etag},
+            {"name": name, "properties": {"state": site.current()}},
+        )
+
+    def arm_slots(self, query, body, app):
+        prefix = f"{app}/slots/"
+        return (
+            200,
+            {},
+            {
+                "value": [
+                    {"name": f"{app}/{name[len(prefix):]}"}
+                    for name in self.sites
+                    if name.startswith(prefix)
+                ]
+            },
+        )
+
+    def arm_toggle_site(self, query, body, app, action, slot=None):
+        name = f"{app}/slots/{slot}" if slot else app
+        site = self.sites.get(name)
+        if site is None:
+            return 404, {}, {"error": {"code": "ResourceNotFound"}}
+        site.change("Running" if action == "start" else "Stopped")
+        return 200, {}, None
+
+    def arm_instances(self, query, body, app):
+        return (
+            200,
+            {},
+            {"value": [{"name": name} for name in self.instance_names(app)]},
+        )
+
+    def arm_web_config(self, query, body, app):
+        return 200, {}, {"properties": {"healthCheckPath": self.health.get(app)}}
+
+    def arm_patch_web_config(self, query, body, app):
+        self.health[app] = body["properties"]["healthCheckPath"]
+        return 200, {}, {"properties": {"healthCheckPath": self.health[app]}}
+
+    def arm_publishing_credentials(self, query, body, app):
+        scm = f"https://${app}:secret@{app}{SCM_SUFFIX}"
+        return 200, {}, {"properties": {"scmUri": scm}}
+
+    def arm_job(self, query, body, job):
+        resource = self.streamingjobs.get(job)
+        if resource is None:
+            return 404, {}, {"error": {"code": "ResourceNotFound"}}
+        transient = "Starting" if resource.state == "Running" else "Stopping"
+        content = {"name": job, "properties": {"jobState": resource.current(transient)}}
+        if "$expand" in query:
+            content["properties"].update(
+                inputs=[], outputs=[], functions=[], transformation={}
+            )
+        return 200, {"ETag": resource.etag}, content
+
+    def arm_toggle_job(self, query, body, job, action):
+        resource = self.streamingjobs.get(job)
+        if resource is None:
+            return 404, {}, {"error": {"code": "ResourceNotFound"}}
+        resource.change("Running" if action == "start" else "Stopped")
+        op = f"{job}-{resource.version}"
+        with self.lock:
+            self.operations[op] = resource.ready_at
+        location = (
+            f"https://{ARM_HOST}/providers/Microsoft.StreamAnalytics"
+            + f"/locations/fake/operationResults/{op}"
+        )
+        return 202, {"Location": location, "Retry-After": "0"}, None
+
+    def arm_operation(self, query, body, op):
+        if time() < self.operations.get(op, 0):
+            return 202, {"Retry-After": "1"}, None
+        return 200, {}, None
+
+    # Kudu
+
+    def scm(self, method, app, path, headers, body):
+        for route_method, pattern, name in self.scm_routes:
+            match = pattern.match(path)
+            if route_method == method and match:
+                break
+        else:
+            self.count(f"{method} scm unknown")
+            return 404, {}, {"Message": "Not found"}
+
+        # ARR pins a client to an instance with the ARRAffinity cookie, and
+        # only ever honours one of them.
+        affinity = set(cookies(headers, "ARRAffinity"))
+        if len(affinity) > 1:
+            self.count(f"{method} scm conflicting affinity")
+            return 400, {}, {"Message": "Conflicting ARRAffinity cookies"}
+        instance = affinity.pop() if affinity else None
+        names = self.instance_names(app)
+        if instance not in names:
+            instance = random.choice(names) if names else None
+            affinity = None
+
+        self.count(f"{method} scm {name}")
+        groups = match.groupdict()
+        if name == "command":
+            groups["instance"] = instance
+        status, response_headers, body = getattr(self, f"scm_{name}")(
+            app, headers, body, **groups
+        )
+        if instance and not affinity:
+            response_headers["Set-Cookie"] = f"ARRAffinity={instance}; Path=/"
+        return status, response_headers, body
+
+    def instance_names(self, app):
+        return [f"{app}-{i:02d}" for i in range(self.instances)]
+
+    def log_tree(self, app):
+        """
+        Return a dict of directory to its entries for an app's LogFiles.
+        """
+        base = 1590000000 + sum(map(ord, app)) * 60
+        span = self.file_size // LINE_WIDTH
+        tree = {"LogFiles": []}
+        for d in range(self.log_dirs):
+            directory = f"LogFiles/dir-{d}"
+            tree["LogFiles"].append((f"dir-{d}", None, base))
+            tree[directory] = []
+            for f in range(self.log_files):
+                start = base + (d * self.log_files + f) * span
+                tree[directory].append((f"{f:03d}.log", start, start + span))
+        return tree
+
+    def log_lines(self, app, start, first, last):
+        """
+        Return the bytes of lines first to last (inclusive) of the log file
+        whose first line was written at start.
+        """
+        lines = []
+        for i in range(first, last + 1):
+            stamp = datetime_string(start + i)
+            line = f"{stamp}.{i % 1000000:06d} {app} INFO synthetic line {i}"
+            lines.append(line.ljust(LINE_WIDTH - 1)[: LINE_WIDTH - 1] + "\n")
+        return "".join(lines).encode()
+
+    def scm_vfs(self, app, headers, body, path):
+        tree = self.log_tree(app)
+        directory = path.rstrip("/")
+        if path.endswith("/") or directory in tree:
+            if directory not in tree:
+                return 404, {}, {"Message": "Not found"}
+            entries = []
+            for name, start, mtime in tree[directory]:
+                full = f"{directory}/{name}"
+                entries.append(
+                    {
+                        "name": name,
+                        "size": 0 if start is None else self.file_size,
+                        "mtime": datetime_string(mtime) + ".1234567+00:00",
+                        "mime": "inode/directory" if start is None else "text/plain",
+                        "path": "C:\\home\\" + full.replace("/", "\\"),
+                        "href": f"https://{app}{SCM_SUFFIX}/api/vfs/{full}",
+                    }
+                )
+            return 200, {}, entries
+
+        parent, _, name = directory.rpartition("/")
+        files = {entry[0]: entry for entry in tree.get(parent, [])}
+        if name not in files or files[name][1] is None:
+            return 404, {}, {"Message": "Not found"}
+
+        size = self.file_size
+
+        def read(first, last):
+            lines = self.log_lines(
+                app, files[name][1], first // LINE_WIDTH, last // LINE_WIDTH
+            )
+            offset = first - first // LINE_WIDTH * LINE_WIDTH
+            return lines[offset : offset + last - first + 1]
+
+        return ranged(headers, size, read, "text/plain")
+
+    def scm_put_vfs(self, app, headers, body, path):
+        return 201, {}, None
+
+    def scm_delete_vfs(self, app, headers, body, path):
+        return 204, {}, None
+
+    def scm_zip(self, app, headers, body, path):
+        block = bytes(range(256)) * 4096
+
+        def read(first, last):
+            chunks = []
+            for offset in range(first - first % len(block), last + 1, len(block)):
+                chunks.append(block)
+            data = b"".join(chunks)
+            start = first % len(block)
+            return data[start : start + last - first + 1]
+
+        return ranged(headers, self.zip_size, read, "application/zip")
+
+    def scm_zipdeploy(self, app, headers, body):
+        deployment = f"{app}-{len(self.deployments)}"
+        with self.lock:
+            self.deployments[deployment] = time() + self.transition
+        location = f"https://{app}{SCM_SUFFIX}/api/deployments/{deployment}"
+        return 202, {"Location": location}, None
+
+    def scm_deployment(self, app, headers, body, deployment):
+        complete = time() >= self.deployments.get(deployment, 0)
+        status = 4 if complete else 1
+        return 200, {}, {"id": deployment, "complete": complete, "status": status}
+
+    def scm_command(self, app, headers, body, instance):
+        command = body.get("command", "")
+        output = f"ran {command} on {instance}\n"
+        return 200, {}, {"Output": output, "Error": "", "ExitCode": 0}
+
+    def scm_endpoint(self, app, headers, body, endpoint):
+        return 200, {}, {"endpoint": endpoint, "app": app}
+
+
+def cookies(headers, name):
+    """
+    Return every value sent for the cookie name, across all Cookie headers.
+    """
+    values = []
+    for header in headers.get_all("Cookie") or []:
+        for cookie in header.split(";"):
+            key, _, value = cookie.strip().partition("=")
+            if key == name:
+                values.append(value)
+    return values
+
+
+def datetime_string(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def ranged(headers, size, read, content_type):
+    """
+    Answer a GET for size bytes produced by read(first, last), honouring a
+    single bytes=first-last Range header.
+    """
+    match = re.match(r"bytes=(\d*)-(\d*)$", headers.get("Range") or "")
+    if not match:
+        return 200, {"Content-Type": content_type}, Stream(read, 0, size - 1)
+
+    first, last = match.groups()
+    if first == "":
+        first, last = max(0, size - int(last)), size - 1
+    else:
+        first, last = int(first), min(int(last or size - 1), size - 1)
+    if first >= size or first > last:
+        return 416, {"Content-Range": f"bytes */{size}"}, None
+    return (
+        206,
+        {"Content-Type": content_type, "Content-Range": f"bytes {first}-{last}/{size}"},
+        Stream(read, first, last),
+    )
+
+
+class Stream:
+    """
+    A response body sent in blocks, so large files never sit in memory.
+    """
+
+    def __init__(self, read, first, last, block_size=256 * 1024):
+        self.read = read
+        self.first = first
+        self.last = last
+        self.block_size = block_size
+
+    def __len__(self):
+        return max(0, self.last - self.first + 1)
+
+    def __iter__(self):
+        for start in range(self.first, self.last + 1, self.block_size):
+            yield self.read(start, min(start + self.block_size - 1, self.last))
+
+
+FakeAzure.arm_routes = compile_routes(ARM_ROUTES)
+FakeAzure.scm_routes = compile_routes(SCM_ROUTES)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+    def read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            data = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                data.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b"".join(data)
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def send(self, status, headers, body):
+        if isinstance(body, Stream):
+            length = len(body)
+        else:
+            body = b"" if body is None else json.dumps(body).encode()
+            length = len(body)
+            if body:
+                headers.setdefault("Content-Type", "application/json")
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+        if status == 304:
+            return
+        for chunk in body if isinstance(body, Stream) else [body]:
+            self.wfile.write(chunk)
+        with self.server.fake.lock:
+            self.server.fake.bytes_out += length
+
+    def handle_request(self):
+        fake = self.server.fake
+        data = self.read_body()
+        with fake.lock:
+            fake.bytes_in += len(data)
+        url = urlsplit(self.path)
+
+        if url.path.startswith("/_fake/"):
+            return self.control(url.path, data)
+
+        with fake.lock:
+            fake.requests += 1
+        host = self.headers.get("X-Forwarded-Host", ARM_HOST)
+        fake.delay()
+        if host.endswith(SCM_SUFFIX):
+            try:
+                body = json.loads(data) if data else {}
+            except ValueError:
+                body = {}
+            app = host[: -len(SCM_SUFFIX)]
+            return self.send(*fake.scm(self.command, app, url.path, self.headers, body))
+
+        body = json.loads(data) if data else None
+        etag = self.headers.get("If-None-Match")
+        self.send(*fake.arm(self.command, url.path, parse_qs(url.query), body, etag))
+
+    def control(self, path, data):
+        fake = self.server.fake
+        if path == "/_fake/options":
+            return self.send(200, {}, fake.options)
+        if path == "/_fake/stats":
+            return self.send(200, {}, fake.stats())
+        if path == "/_fake/reset":
+            fake.reset(**(json.loads(data) if data else {}))
+            return self.send(200, {}, fake.options)
+        self.send(404, {}, None)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_request
+
+
+def serve(fake, host="127.0.0.1", port=0):
+    """
+    Return a ThreadingHTTPServer for fake; call serve_forever() on it.
+    """
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.request_queue_size = 128
+    server.fake = fake
+    return server
+
+
+def add_fake_args(parser):
+    """
+    Options shaping the fake resource group, shared with the benchmark
+    runner.
+    """
+    parser.add_argument("--apps", type=int, default=20, help="number of apps")
+    parser.add_argument("--slots", type=int, default=1, help="slots per app")
+    parser.add_argument("--instances", type=int, default=2, help="instances per app")
+    parser.add_argument("--jobs", type=int, default=10, help="stream analytics jobs")
+    parser.add_argument(
+        "--latency", type=float, default=20, help="mean response latency in ms"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=5, help="latency jitter either way in ms"
+    )
+    parser.add_argument(
+        "--transition",
+        type=float,
+        default=1.0,
+        help="seconds a start, stop or deployment takes to finish",
+    )
+    parser.add_argument(
+        "--read_rate",
+        type=float,
+        default=0,
+        help="ARM reads allowed per second before throttling (0 is unlimited)",
+    )
+    parser.add_argument(
+        "--write_rate",
+        type=float,
+        default=0,
+        help="ARM writes allowed per second before throttling (0 is unlimited)",
+    )
+    parser.add_argument(
+        "--burst", type=int, default=0, help="ARM requests allowed in a burst"
+    )
+    parser.add_argument(
+        "--log_dirs", type=int, default=4, help="log directories per app"
+    )
+    parser.add_argument(
+        "--log_files", type=int, default=10, help="log files per directory"
+    )
+    parser.add_argument(
+        "--log_size", type=int, default=256 * 1024, help="bytes per log file"
+    )
+    parser.add_argument(
+        "--zip_size", type=int, default=16 * 1024 * 1024, help="bytes per zip"
+    )
+
+
+def fake_options(args):
+    return dict(
+        apps=args.apps,
+        slots=args.slots,
+        instances=args.instances,
+        jobs=args.jobs,
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        transition=args.transition,
+        read_rate=args.read_rate,
+        write_rate=args.write_rate,
+        burst=args.burst,
+        log_dirs=args.log_dirs,
+        log_files=args.log_files,
+        log_size=args.log_size,
+        zip_size=args.zip_size,
+    )
+
+
+def main():
+    parser = ArgumentParser(description="Local ARM and Kudu stand-in server")
+    parser.add_argument("--port", type=int, default=0, help="port to listen on")
+    add_fake_args(parser)
+    parser.add_argument("-v", action="count", default=0, help="increase verbosity")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.v else logging.WARNING)
+
+    server = serve(FakeAzure(**fake_options(args)), port=args.port)
+    print(f"Listening on {server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""
+Scenario benchmarks for azure_extras against the local stand-in server.
+
+Each scenario drives the same functions the CLIs use (kuductl's through its
+main), in a fresh process with its own HOME, so peak RSS and caches aren't
+shared between them.
+Requests are forwarded to benchmarks.fakeazure by an adapter mounted on the
+shared session, which also times them.
+
+    python -m benchmarks.run
+    python -m benchmarks.run asctl asctl-batch --apps 100 --latency 50
+    python -m benchmarks.run tail --log_files 200 --read_rate 5 --json out.json
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from threading import Lock
+from time import perf_counter, time
+from urllib.parse import urlsplit, urlunsplit
+from urllib.request import Request, urlopen
+from .fakeazure import add_fake_args, fake_options
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+RG = "benchmarks"
+
+# name: (description, fake overrides)
+SCENARIOS = {
+    "asctl": ("stop every app and slot, one request each", {}),
+    "asctl-batch": ("stop every app and slot with ARM batches", {}),
+    "asctl-reconcile": ("start a half stopped fleet", {"stopped": 0.5}),
+    "select": ("select running apps by tag", {}),
+    "healthchk": ("enable health checks on every app", {}),
+    "healthchk-reconcile": ("disable health checks that are already off", {}),
+    "sajctl": ("start every job, one request each", {"stopped": 1.0}),
+    "sajctl-batch": ("start every job with ARM batches", {"stopped": 1.0}),
+    "logs": ("tail the logs of one app", {}),
+    "tail": ("tail and merge the logs of every app", {}),
+    "fanout": ("run a command on every instance of every app", {}),
+    "zip-download": ("download a zip of wwwroot", {}),
+    "zip-deploy": ("deploy a zip", {}),
+}
+
+
+def control(port, path, options=None):
+    data = json.dumps(options).encode() if options is not None else None
+    request = Request(f"http://127.0.0.1:{port}/_fake/{path}", data=data)
+    with urlopen(request) as response:
+        return json.load(response)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def peak_rss():
+    """
+    Peak resident set size of this process in MB, or None if unknown.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes.
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def make_adapter(port, pool_size, latencies, lock):
+    from requests.adapters import HTTPAdapter
+
+    class ForwardingAdapter(HTTPAdapter):
+        """
+        Send every request to the fake server, with the host it was meant for
+        in X-Forwarded-Host, and time how long its headers take to arrive.
+        """
+
+        def __init__(self):
+            super().__init__(
+                pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True
+            )
+
+        def send(self, request, **kwargs):
+            url = request.url
+            parts = urlsplit(url)
+            request.headers["X-Forwarded-Host"] = parts.hostname
+            request.url = urlunsplit(
+                ("http", f"127.0.0.1:{port}", parts.path, parts.query, "")
+            )
+            start = perf_counter()
+            response = super().send(request, **kwargs)
+            elapsed = perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+            request.url = response.url = url
+            return response
+
+    return ForwardingAdapter()
+
+
+def setup(port):
+    """
+    Route the shared session to the fake server and hand every client a
+    long lived token, returning (config path, list of request latencies).
+
+    The session still picks its own pool size, and grows it, as it would
+    against Azure, so the CLIs' pool sizing is part of what's measured.
+    """
+    from azure_extras.lib.auth import get_token_provider
+    from azure_extras.lib.session import AzureSession
+
+    config = os.path.join(os.environ["HOME"], "azure.ini")
+    with open(config, "w") as f:
+        f.write("[azure]\nclient = c\nsecret = s\ntenant = fake\nsub = fake\n")
+
+    provider = get_token_provider(config)
+    provider.tenant, provider.subscription, provider.source = "fake", "fake", "sp"
+    provider.token, provider.expires_on = "fake", time() + 86400
+
+    latencies = []
+    lock = Lock()
+
+    def mount_adapters(session, pool_size):
+        adapter = make_adapter(port, pool_size, latencies, lock)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+    AzureSession.mount_adapters = mount_adapters
+    return config, latencies
+
+
+def kuductl_main(*argv):
+    """
+    Run kuductl as its console script would, arguments and all.
+    """
+    from azure_extras import kuductl
+
+    sys.argv = ["az-kuductl", *argv]
+    kuductl.main()
+
+
+def run_scenario(name, config, options, args):
+    from azure_extras import asctl, healthchkctl, sajctl
+    from azure_extras.lib.app import AppService
+
+    apps = [f"app-{i:03d}" for i in range(options["apps"])]
+    jobs = [f"job-{i:03d}" for i in range(options["jobs"])]
+    home = os.environ["HOME"]
+
+    if name == "asctl":
+        asctl.asctl(config, RG, apps, "stop", args.concurrency)
+    elif name == "asctl-batch":
+        asctl.asctl_batch(config, RG, apps, "stop")
+    elif name == "asctl-reconcile":
+        asctl.asctl_reconcile(config, RG, apps, "start")
+    elif name == "select":
+        AppService(config, RG).select_app_services("fake", state="Running")
+    elif name == "healthchk":
+        healthchkctl.healthchkctl(config, RG, apps, "enable")
+    elif name == "healthchk-reconcile":
+        healthchkctl.healthchkctl_reconcile(config, RG, apps, "disable")
+    elif name == "sajctl":
+        sajctl.sajctl(config, RG, jobs, "start")
+    elif name == "sajctl-batch":
+        sajctl.sajctl_batch(config, RG, jobs, "start")
+    elif name == "logs":
+        kuductl_main("-C", config, "-r", RG, "-a", apps[0], "-l", str(args.lines))
+    elif name == "tail":
+        kuductl_main("-C", config, "-r", RG, "-a", *apps, "-l", str(args.lines))
+    elif name == "fanout":
+        kuductl_main("-C", config, "-r", RG, "-a", *apps, "-c", "hostname")
+    elif name == "zip-download":
+        path = os.path.join(home, "wwwroot.zip")
+        kuductl_main("-C", config, "-r", RG, "-a", apps[0], "-Z", "site/wwwroot/", path)
+    elif name == "zip-deploy":
+        path = os.path.join(home, "deploy.zip")
+        with open(path, "wb") as f:
+            f.truncate(options["zip_size"])
+        kuductl_main("-C", config, "-r", RG, "-a", apps[0], "-z", path)
+
+
+def child(args):
+    """
+    Run one scenario and print its client side measurements as json.
+    """
+    options = control(args.port, "options")
+    config, latencies = setup(args.port)
+    startup_rss = peak_rss()
+
+    error = None
+    start = perf_counter()
+    try:
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            run_scenario(args.child, config, options, args)
+    except (Exception, SystemExit) as exception:
+        error = f"{type(exception).__name__}: {exception}"
+    wall = perf_counter() - start
+
+    print(
+        json.dumps(
+            {
+                "wall": wall,
+                "requests": len(latencies),
+                "p50": percentile(latencies, 0.5) * 1000,
+                "p99": percentile(latencies, 0.99) * 1000,
+                "startup_rss": startup_rss,
+                "peak_rss": peak_rss(),
+                "error": error,
+            }
+        )
+    )
+
+
+def start_server(args):
+    command = [sys.executable, "-m", "benchmarks.fakeazure", "--port", "0"]
+    for name, value in vars(args).items():
+        if name in fake_options(args):
+            command += [f"--{name}", str(value)]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    port = int(server.stdout.readline().split()[-1])
+    return server, port
+
+
+def run(args):
+    server, port = start_server(args)
+    baseline = fake_options(args)
+    results = {}
+    try:
+        for name in args.scenarios or SCENARIOS:
+            description, overrides = SCENARIOS[name]
+            control(port, "reset", {**baseline, "stopped": 0.0, **overrides})
+            with tempfile.TemporaryDirectory() as home:
+                output = subprocess.run(
+                    [
+                        sys.executable,
+                        "-m",
+                        "benchmarks.run",
+                        "--child",
+                        name,
+                        "--port",
+                        str(port),
+                        "--concurrency",
+                        str(args.concurrency),
+                        "--lines",
+                        str(args.lines),
+                    ],
+                    env=dict(os.environ, HOME=home),
+                    stdout=subprocess.PIPE,
+                    text=True,
+                    check=True,
+                ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            result["description"] = description
+            result["server"] = control(port, "stats")
+            results[name] = result
+            report(name, result)
+    finally:
+        server.terminate()
+        server.wait()
+    return results
+
+
+def report(name, result):
+    wall = result["wall"]
+    server = result["server"]
+    rate = result["requests"] / wall if wall else 0
+    rss = result["peak_rss"]
+    print(
+        f"{name:<20} {wall:>8.2f} {result['requests']:>9} {rate:>8.1f} "
+        + f"{result['p50']:>8.1f} {result['p99']:>8.1f} {server['throttled']:>9} "
+        + (f"{rss:>8.1f}" if rss else f"{'-':>8}")
+    )
+    for operation, count in server["operations"].items():
+        print(f"    {operation:<40} {count:>7}")
+    if result["error"]:
+        print(f"    FAILED: {result['error']}")
+
+
+def get_args():
+    parser = ArgumentParser(description="Benchmark azure_extras against a fake ARM")
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        metavar="SCENARIO",
+        help="scenarios to run, out of " + ", ".join(SCENARIOS),
+    )
+    parser.add_argument(
+        "-n",
+        "--concurrency",
+        type=int,
+        default=20,
+        metavar=("N"),
+        help="maximum concurrent requests",
+    )
+    parser.add_argument(
+        "--lines", type=int, default=1000, help="log lines per app to tail"
+    )
+    parser.add_argument("--json", metavar=("PATH"), help="also write results here")
+    parser.add_argument("--child", help="run one scenario, used internally")
+    parser.add_argument("--port", type=int, help="fake server port, used internally")
+    add_fake_args(parser)
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}")
+    return args
+
+
+def main():
+    args = get_args()
+    if args.child:
+        return child(args)
+
+    print(
+        f"{'scenario':<20} {'wall s':>8} {'requests':>9} {'req/s':>8} "
+        + f"{'p50 ms':>8} {'p99 ms':>8} {'throttled':>9} {'peak MB':>8}"
+    )
+    results = run(args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
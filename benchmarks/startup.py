@@ -0,0 +1,142 @@
+"""
+Import time of every console_scripts entry point in setup.py, and of the
+commands they run in-process when no daemon is up, measured in fresh
+interpreters, along with which heavy optional dependencies each one drags in.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --repeat 20 --json startup.json
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+from argparse import ArgumentParser
+from statistics import median
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY_POINT = re.compile(r'"([\w-]+) = ([\w.]+):(\w+)"')
+
+# Modules that should only be imported on the code paths that need them.
+HEAVY = ("aiohttp", "asyncio", "azure.common", "msrestazure", "adal", "yaml")
+
+PROBE = """
+import json, sys
+from time import perf_counter
+start = perf_counter()
+import {module}
+elapsed = perf_counter() - start
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"elapsed": elapsed, "heavy": heavy}}))
+"""
+
+
+def entry_points(path=os.path.join(ROOT, "setup.py")):
+    """
+    Return a dict of script name to module, read from setup.py's source so
+    the package doesn't need to be installed.
+    """
+    with open(path) as f:
+        return {script: module for script, module, _ in ENTRY_POINT.findall(f.read())}
+
+
+def targets():
+    """
+    Return a dict of name to module for every entry point, plus the command
+    modules they import when there's no daemon to forward to.
+    """
+    from azure_extras.lib.rpc import COMMANDS
+
+    modules = entry_points()
+    for command, module in COMMANDS.items():
+        modules[f"{command} (no daemon)"] = module
+    return modules
+
+
+def probe(module):
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY)],
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        check=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def import_times(code):
+    """
+    Return a dict of module to cumulative import time in microseconds for
+    running code, according to python -X importtime.
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT,
+        stderr=subprocess.PIPE,
+        check=True,
+        text=True,
+    ).stderr
+    times = {}
+    for line in stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            times[fields[2].strip()] = int(fields[1])
+    return times
+
+
+def slowest_imports(module, count):
+    """
+    Return (microseconds, name) for the count slowest imports of module,
+    leaving out what the interpreter imports at startup anyway.
+    """
+    if not count:
+        return []
+    startup = import_times("pass")
+    imports = [
+        (micros, name)
+        for name, micros in import_times(f"import {module}").items()
+        if name not in startup
+    ]
+    return sorted(imports, reverse=True)[:count]
+
+
+def get_args():
+    parser = ArgumentParser(description="Measure CLI import time")
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=10, help="fresh interpreters per script"
+    )
+    parser.add_argument(
+        "-t", "--top", type=int, default=0, help="also list the N slowest imports"
+    )
+    parser.add_argument("--json", metavar=("PATH"), help="also write results here")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    results = {}
+    print(f"{'script':<26} {'module':<28} {'min ms':>7} {'median ms':>9}  heavy")
+    for script, module in targets().items():
+        runs = [probe(module) for _ in range(args.repeat)]
+        times = [run["elapsed"] * 1000 for run in runs]
+        heavy = runs[-1]["heavy"]
+        results[script] = {
+            "module": module,
+            "min": min(times),
+            "median": median(times),
+            "heavy": heavy,
+        }
+        print(
+            f"{script:<26} {module:<28} {min(times):>7.1f} {median(times):>9.1f}  "
+            + (", ".join(heavy) or "-")
+        )
+        for micros, name in slowest_imports(module, args.top):
+            print(f"    {name:<48} {micros / 1000:>7.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
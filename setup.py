@@ -34,7 +34,12 @@ setuptools.setup(
         "msrestazure",
         "requests",
     ],
-    packages=setuptools.find_packages(),
+    extras_require={
+        "aio": ["aiohttp"],
+        "otel": ["opentelemetry-api"],
+        "yaml": ["pyyaml"],
+    },
+    packages=setuptools.find_packages(exclude=["benchmarks", "benchmarks.*"]),
     classifiers=(
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: ISC License (ISCL)",
@@ -42,10 +47,12 @@ setuptools.setup(
     ),
     entry_points={
         "console_scripts": [
-            "az-asctl = azure_extras.asctl:main",
-            "az-healthchkctl = azure_extras.healthchkctl:main",
-            "az-kuductl = azure_extras.kuductl:main",
-            "az-sajctl = azure_extras.sajctl:main",
+            "azure-extras = azure_extras.__main__:main",
+            "az-asctl = azure_extras.__main__:asctl",
+            "az-healthchkctl = azure_extras.__main__:healthchkctl",
+            "az-kuductl = azure_extras.__main__:kuductl",
+            "az-planctl = azure_extras.__main__:planctl",
+            "az-sajctl = azure_extras.__main__:sajctl",
         ],
     },
 )